@@ -0,0 +1,452 @@
+import argparse
+import asyncio
+from calendar import isleap
+import csv
+from datetime import date, datetime, timedelta
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+
+import bot_helper_with_birthday as legacy_bot
+import bot_helper_with_class as class_bot
+import bot_helper_with_search as bot
+import bot_server
+
+VARIANTS = {
+    "class": class_bot,
+    "birthday": legacy_bot,
+    "search": bot,
+}
+
+FIRST_NAMES = [
+    "Olena", "Andrii", "Iryna", "Oleksandr", "Natalia", "Dmytro", "Kateryna", "Serhii",
+    "Tetiana", "Mykola", "Yulia", "Volodymyr", "Oksana", "Ivan", "Svitlana", "Taras",
+]
+LAST_NAMES = [
+    "Shevchenko", "Kovalenko", "Bondarenko", "Tkachenko", "Kravchenko", "Oliinyk",
+    "Shevchuk", "Polishchuk", "Bondar", "Tkachuk", "Marchenko", "Lysenko",
+]
+OPERATORS = ["50", "63", "66", "67", "68", "73", "93", "95", "96", "97", "98", "99"]
+
+
+def legacy_command_parser(user_input: str):
+    for key_word, command in bot.COMMANDS.items():
+        if user_input.lower().startswith(key_word):
+            return command, user_input.replace(key_word, "").strip().split(" ")
+    return None, None
+
+
+def bench_command_parser(number: int = 100000):
+    """Microseconds per parse. `trie` is the command_parser the bot runs, including its
+    @timed statistics wrapper, and is slower than the legacy scan (about 1.1 vs 0.9 us).
+    `trie_untimed` is the parse alone (about 0.4 us)."""
+    inputs = [
+        "add bob 123456 2000-01-01",
+        "phone remove bob 123456",
+        "days to birthday bob",
+        "search 12",
+        "exit",
+        "unknown command",
+    ]
+    results = {}
+    parsers = (
+        ("legacy", legacy_command_parser),
+        ("trie", bot.command_parser),
+        ("trie_untimed", bot.command_parser.__wrapped__),
+    )
+    for label, parser in parsers:
+        seconds = timeit.timeit(lambda: [parser(line) for line in inputs], number=number)
+        results[label] = seconds / (number * len(inputs)) * 1e6
+    return results
+
+
+def bench_record_memory(count: int = 100000):
+    results = {}
+    for label, module in (("legacy", legacy_bot), ("slots", bot)):
+        tracemalloc.start()
+        records = [
+            module.Record(
+                module.Name(f"name{i}"),
+                module.Phone(f"380{i:09}"),
+                module.Birthday(f"19{i % 100:02}-{i % 12 + 1:02}-{i % 28 + 1:02}")
+            )
+            for i in range(count)
+        ]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[label] = size / len(records)
+    return results
+
+
+def bench_book_memory(size: int = 50000) -> dict:
+    """Bytes per contact held by a search-variant book with all of its indexes, and the share
+    of each structure, measured as the memory released by dropping it."""
+    contacts = generate_contacts(size)
+    tracemalloc.start()
+    book = bot.AddressBook(os.path.join(tempfile.gettempdir(), "memory.csv"))
+    for row in contacts:
+        book.add_record(build_record(bot, *row))
+    results = {"total": tracemalloc.get_traced_memory()[0] / size}
+    for attribute in ("history", "index", "phone_index", "calendar", "names_tree", "data"):
+        before = tracemalloc.get_traced_memory()[0]
+        setattr(book, attribute, {} if attribute == "data" else None)
+        results[attribute] = (before - tracemalloc.get_traced_memory()[0]) / size
+    tracemalloc.stop()
+    return results
+
+
+async def _server_load(clients: int, commands: int):
+    server = await bot_server.BotServer().start(port=0)
+    port = server.sockets[0].getsockname()[1]
+    latencies = []
+
+    async def client(client_id: int):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for i in range(commands):
+            if i % 10 == 0:
+                line = f"add client{client_id}_{i} {i + 1}"
+            else:
+                line = f"search client{client_id}"
+            started = time.perf_counter()
+            await bot_server.request(reader, writer, line)
+            latencies.append(time.perf_counter() - started)
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.perf_counter() - started
+    server.close()
+    await server.wait_closed()
+    latencies.sort()
+    return {
+        "commands_per_sec": len(latencies) / elapsed,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def bench_server(client_counts=(1, 4, 16, 64), commands: int = 200):
+    return {clients: asyncio.run(_server_load(clients, commands)) for clients in client_counts}
+
+
+def bench_bulk_load(count: int = 200000, worker_counts=(1, None)):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "import.csv")
+        with open(path, 'w', encoding='UTF8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Name", "Phones", "Birthday"])
+            for i in range(count):
+                writer.writerow([f"name{i}", f"[380{i:09}]", f"19{i % 100:02}-{i % 12 + 1:02}-{i % 28 + 1:02}"])
+        results = {}
+        for workers in worker_counts:
+            book = bot.AddressBook(os.path.join(tmp, "addressbook.csv"))
+            started = time.perf_counter()
+            book.bulk_load(path, workers=workers)
+            results[workers or os.cpu_count()] = count / (time.perf_counter() - started)
+        return results
+
+
+def stress_threads(readers: int = 4, writers: int = 2, seconds: float = 2.0, size: int = 10000,
+                   storage: bool = False) -> dict:
+    """Runs searches and show_all pages against concurrent writers that add and remove records
+    and add their first `shared_writes` phones to one shared record; with `storage` the book is kept in SQLite.
+
+    Raises AssertionError on any exception, on a lost phone of the shared record, or when the
+    index disagrees with the book afterwards.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        book = bot.AddressBook(os.path.join(tmp, "stress.csv"))
+        if storage:
+            book.open_storage(bot.SqliteStorage(os.path.join(tmp, "stress.db")))
+        for name, phones, birthday in generate_contacts(size):
+            book.add_record(build_record(bot, name, phones, birthday))
+        book.add_record(bot.Record(bot.Name("shared"), bot.Phone("0")))
+        stop = threading.Event()
+        counts = {"reads": 0, "writes": 0}
+        errors = []
+        removed = []
+        shared_phones = {"0"}
+        shared_writes = 200
+
+        def reader(seed: int):
+            rng = random.Random(seed)
+            while not stop.is_set():
+                try:
+                    if rng.random() < 0.5:
+                        list(book.search(rng.choice(OPERATORS) + str(rng.randrange(10))))
+                    else:
+                        for _ in book.iterator(100):
+                            pass
+                    counts["reads"] += 1
+                except Exception as e:
+                    errors.append(repr(e))
+
+        def writer(seed: int):
+            rng = random.Random(seed)
+            i = 0
+            while not stop.is_set():
+                try:
+                    name = f"writer{seed}_{i}"
+                    book.add_record(bot.Record(bot.Name(name), bot.Phone(str(rng.randrange(10 ** 9)))))
+                    book[name].add_phone(bot.Phone(str(i)))
+                    if i % 2:
+                        book.remove_record(f"writer{seed}_{i - 1}")
+                        removed.append(f"writer{seed}_{i - 1}")
+                    if i < shared_writes:
+                        phone = f"{seed + 1}{i:07}"
+                        book["shared"].add_phone(bot.Phone(phone))
+                        shared_phones.add(phone)
+                    counts["writes"] += 1
+                    i += 1
+                except Exception as e:
+                    errors.append(repr(e))
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        missing, stale, lost = [], [], []
+        try:
+            missing = [name for name in book if name not in {r.name.value for r in book.search(name)}][:10]
+            stale = [name for name in removed if name in book or any(r.name.value == name for r in book.search(name))][:10]
+            lost = sorted(shared_phones - set(book["shared"].phones))[:10]
+        except Exception as e:
+            errors.append(repr(e))
+        if storage:
+            book.storage.close()
+    if errors or missing or stale or lost:
+        raise AssertionError(
+            f"Concurrent access broke the book: errors {errors[:10]}, missing from index {missing}, "
+            f"removed but still found {stale}, phones lost from the shared record {lost}"
+        )
+    return {
+        "reads_per_sec": counts["reads"] / seconds,
+        "writes_per_sec": counts["writes"] / seconds,
+        "removals": len(removed),
+    }
+
+
+def bench_scan(size: int = 200000, shard_counts=(1, None), queries: int = 20) -> dict:
+    book = bot.AddressBook(os.path.join(tempfile.gettempdir(), "scan.csv"))
+    book.merge([build_record(bot, *row) for row in generate_contacts(size)])
+    rng = random.Random(size)
+    patterns = [f"{rng.choice(OPERATORS)}\\d{{3}}{rng.randrange(10)}$" for _ in range(queries)]
+    results = {}
+    for shards in shard_counts:
+        book.scanner = bot.ShardedScanner(shards)
+        list(book.scan(patterns[0]))
+        results[book.scanner.shards] = timed(lambda: [list(book.scan(p)) for p in patterns]) / queries
+        book.scanner.close()
+    book.scanner = None
+    return results
+
+
+def bench_birthdays(size: int = 200000) -> dict:
+    book = bot.AddressBook(os.path.join(tempfile.gettempdir(), "birthdays.csv"))
+    book.merge([build_record(bot, *row) for row in generate_contacts(size)])
+    today = date.today()
+    now = datetime.now()
+    loop = timed(lambda: [record.birthday.days_diff(now) for record in book.values() if record.birthday])
+    return {
+        "per_record_loop": loop,
+        "vectorized": timed(lambda: book.days_to_birthdays(today + timedelta(days=1))),
+        "cached": timed(lambda: book.days_to_birthdays(today + timedelta(days=1))),
+        "next_day": timed(lambda: book.days_to_birthdays(today + timedelta(days=2))),
+    }
+
+
+def generate_contacts(count: int, seed: int = 0) -> list[tuple]:
+    """Synthetic (name, phones, birthday) rows: mostly one mobile number, 80% with a birthday."""
+    rng = random.Random(seed)
+    contacts = []
+    for i in range(count):
+        name = f"{rng.choice(FIRST_NAMES)}{rng.choice(LAST_NAMES)}{i}"
+        phones = [
+            f"380{rng.choice(OPERATORS)}{rng.randrange(10 ** 7):07}"
+            for _ in range(rng.choices((1, 2, 3), weights=(70, 25, 5))[0])
+        ]
+        birthday = None
+        if rng.random() < 0.8:
+            year = min(2010, max(1940, int(rng.gauss(1985, 15))))
+            birthday = (date(year, 1, 1) + timedelta(days=rng.randrange(366 if isleap(year) else 365))).isoformat()
+        contacts.append((name, phones, birthday))
+    return contacts
+
+
+def build_record(module, name: str, phones: list[str], birthday: str):
+    if hasattr(module, "Birthday"):
+        record = module.Record(
+            module.Name(name),
+            module.Phone(phones[0]),
+            module.Birthday(birthday) if birthday else None
+        )
+    else:
+        record = module.Record(module.Name(name), module.Phone(phones[0]))
+    for phone in phones[1:]:
+        record.add_phone(module.Phone(phone))
+    return record
+
+
+def consume(result):
+    if not isinstance(result, str):
+        for _ in result:
+            pass
+
+
+def timed(func) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def build_book(module, contacts: list[tuple], filename: str):
+    book = module.AddressBook(filename) if module is bot else module.AddressBook()
+    for row in contacts:
+        book.add_record(build_record(module, *row))
+    return book
+
+
+def bench_variant(module, contacts: list[tuple], memory: bool = True, queries: int = 100) -> dict:
+    results = {}
+    rng = random.Random(len(contacts))
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "addressbook.csv")
+        started = time.perf_counter()
+        book = build_book(module, contacts, filename)
+        results["add_record"] = time.perf_counter() - started
+
+        if memory:
+            del book
+            tracemalloc.start()
+            book = build_book(module, contacts, filename)
+            current, peak = tracemalloc.get_traced_memory()
+            results["memory_peak_bytes"] = peak
+            results["memory_bytes_per_contact"] = current / max(len(contacts), 1)
+            tracemalloc.stop()
+
+        if hasattr(book, "search"):
+            terms = []
+            for name, phones, _ in rng.sample(contacts, min(queries, len(contacts))):
+                terms.append(name[2:6])
+                terms.append(phones[0][-5:])
+            results["search"] = timed(lambda: [list(book.search(term)) for term in terms]) / len(terms)
+
+        if hasattr(book, "iterator"):
+            results["iterator"] = timed(lambda: [page for page in book.iterator(100)])
+
+        saved_contacts = module.contacts
+        module.contacts = book
+        try:
+            results["show_all"] = timed(lambda: consume(module.show_all()))
+        finally:
+            module.contacts = saved_contacts
+
+        if hasattr(book, "write_to_csv"):
+            results["write_to_csv"] = timed(book.write_to_csv)
+            loaded = module.AddressBook(filename)
+            results["load_from_csv"] = timed(loaded.load_from_csv)
+            lazy = module.AddressBook(filename)
+            results["load_from_csv_lazy"] = timed(lambda: lazy.load_from_csv(lazy=True))
+
+        if hasattr(module, "BinarySnapshot"):
+            binary = os.path.join(tmp, "addressbook.bin")
+            rows = book.snapshot_rows()
+            results["write_snapshot_bin"] = timed(lambda: module.BinarySnapshot.write(binary, rows))
+            mapped = module.AddressBook(binary)
+            results["load_snapshot_bin"] = timed(mapped.load_snapshot)
+            names = [row[0] for row in rng.sample(contacts, min(queries, len(contacts)))]
+            results["lookup_snapshot_bin"] = timed(lambda: [mapped[name] for name in names]) / len(names)
+            mapped.close()
+
+        if hasattr(module, "Birthday"):
+            now = datetime.now()
+            # Feb 29 is skipped because the older variants raise ValueError for it in non-leap years
+            birthdays = [
+                record.birthday for record in book.values()
+                if record.birthday and (record.birthday.value.month, record.birthday.value.day) != (2, 29)
+            ]
+            results["days_diff"] = timed(lambda: [birthday.days_diff(now) for birthday in birthdays])
+    return results
+
+
+def run_suite(sizes, variants, seed: int = 0, memory: bool = True) -> dict:
+    results = {}
+    for size in sizes:
+        contacts = generate_contacts(size, seed)
+        results[str(size)] = {}
+        for variant in variants:
+            results[str(size)][variant] = bench_variant(VARIANTS[variant], contacts, memory)
+            for operation, value in results[str(size)][variant].items():
+                print(f"{size:>9} {variant:10} {operation:20} {value:.6g}")
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict):
+    for size, variants in results.items():
+        for variant, operations in variants.items():
+            for operation, value in operations.items():
+                old = baseline.get(size, {}).get(variant, {}).get(operation)
+                if old:
+                    print(f"{size:>9} {variant:10} {operation:20} {value / old:6.2f}x of {old:.6g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the address book variants")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak measurement")
+    parser.add_argument("--micro", action="store_true", help="also run parser, memory, import and server benchmarks")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "results": run_suite(args.sizes, args.variants, args.seed, not args.no_memory),
+    }
+    if args.micro:
+        report["micro"] = {
+            "command_parser_usec": bench_command_parser(),
+            "record_memory_bytes": bench_record_memory(),
+            "book_memory_bytes_per_contact": bench_book_memory(),
+            "bulk_load_rows_per_sec": bench_bulk_load(),
+            "server": bench_server(),
+            "threads": stress_threads(),
+            "threads_sqlite": stress_threads(size=2000, storage=True),
+            "scan_seconds_per_query": bench_scan(),
+            "birthdays_seconds": bench_birthdays(),
+        }
+        print(json.dumps(report["micro"], indent=2))
+    with open(args.output, 'w', encoding='UTF8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding='UTF8') as file:
+            compare(report["results"], json.load(file)["results"])
+
+
+if __name__ == '__main__':
+    main()
@@ -67,11 +67,59 @@ COMMANDS = {
     "exit": close,
 }
 
+def build_command_trie(commands: dict) -> dict:
+    trie = {}
+    for key_word, command in commands.items():
+        node = trie
+        for token in key_word.split():
+            node = node.setdefault(token, {})
+        node[None] = command
+    return trie
+
+
+COMMAND_TRIE = build_command_trie(COMMANDS)
+
+
+def tokenize(user_input: str) -> list[str]:
+    if '"' not in user_input and "'" not in user_input:
+        return user_input.split()
+    tokens = []
+    token = []
+    quote = None
+    started = False
+    for char in user_input:
+        if quote:
+            if char == quote:
+                quote = None
+            else:
+                token.append(char)
+        elif char in "'\"" and not started:
+            quote = char
+            started = True
+        elif char.isspace():
+            if started:
+                tokens.append("".join(token))
+                token = []
+                started = False
+        else:
+            token.append(char)
+            started = True
+    if started:
+        tokens.append("".join(token))
+    return tokens
+
+
 def command_parser(user_input: str):
-    for  key_word, command in COMMANDS.items():
-        if user_input.lower().startswith(key_word):
-            return command, user_input.replace(key_word, "").strip().split(" ")
-    return None, None
+    tokens = tokenize(user_input)
+    node = COMMAND_TRIE
+    command, args = None, None
+    for i, token in enumerate(tokens):
+        node = node.get(token.lower())
+        if node is None:
+            break
+        if None in node:
+            command, args = node[None], tokens[i + 1:]
+    return command, args
 
 
 
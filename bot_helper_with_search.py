@@ -1,9 +1,39 @@
-from collections import UserDict
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, UserDict, defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from concurrent.futures import ProcessPoolExecutor
 import csv
-from datetime import date, datetime
+from calendar import isleap
+from datetime import date, datetime, timedelta
+from functools import wraps
+import io
+from itertools import chain, groupby, islice, repeat, zip_longest
+import json
+import mmap
+from operator import eq, ge, gt, itemgetter, le, lt
+import os
 import os.path
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class Field:
+    __slots__ = ("__private_value",)
+
     def __init__(self, value):
         self.__private_value = None
         self.value = value
@@ -29,26 +59,61 @@ class Field:
 
 
 class Name(Field):
-    pass
+    __slots__ = ()
+
+    def __init__(self, value: str):
+        super().__init__(sys.intern(value))
 
 
 class Phone(Field):
+    """Phone number kept as canonical digits: '+380 (50) 123-45-67' becomes '380501234567'.
+
+    `key` packs the digits and their count into one int, so phones compare and hash as ints.
+    """
+    __slots__ = ("_value", "key")
+    separators = re.compile(r"[\s\-().]")
+    max_digits = 15
+
     def __init__(self, value):
         self.value = value
 
+    def __eq__(self, other):
+        return isinstance(other, Phone) and self.key == other.key
+
+    def __hash__(self):
+        return self.key
+
     @property
     def value(self):
         return self._value
 
     @value.setter
     def value(self, value: str):
-        if value.isnumeric():
-            self._value = value
-        else:
+        digits = self.normalize(value)
+        self.key = self.pack(digits)
+        self._value = digits
+
+    @classmethod
+    def normalize(cls, value: str) -> str:
+        digits = cls.separators.sub("", value)
+        if digits.startswith("+"):
+            digits = digits[1:]
+        if not (digits.isascii() and digits.isdigit()) or len(digits) > cls.max_digits:
             raise Exception("Please enter correct phone number")
+        return digits
+
+    @staticmethod
+    def pack(digits: str) -> int:
+        return int(digits) << 4 | len(digits)
+
+    @staticmethod
+    def unpack(key: int) -> str:
+        return str(key >> 4).zfill(key & 15)
 
 
 class Birthday(Field):
+    __slots__ = ("_value",)
+
     def __init__(self, value: str):
         self.value = value
 
@@ -63,123 +128,2244 @@ class Birthday(Field):
         else:
             raise Exception("Please enter date number as 'YYYY-MM-DD'")
 
+    @staticmethod
+    def anniversary(year: int, month: int, day: int) -> datetime:
+        if month == 2 and day == 29 and not isleap(year):
+            day = 28
+        return datetime(year, month, day)
+
     def days_diff(self, date):
 
-        delta1 = datetime(date.year, self.value.month, self.value.day)
-        delta2 = datetime(date.year + 1, self.value.month, self.value.day)
+        delta1 = self.anniversary(date.year, self.value.month, self.value.day)
+        delta2 = self.anniversary(date.year + 1, self.value.month, self.value.day)
         if delta1 > date:
             return (delta1 - date).days
         else:
             return (delta2 - date).days
 
+    def days_until(self, today: date) -> int:
+        """Days from `today` to the next birthday, 0 when it is today."""
+        for year in (today.year, today.year + 1):
+            birthday = self.anniversary(year, self.value.month, self.value.day).date()
+            if birthday >= today:
+                return (birthday - today).days
+
     def __str__(self):
         return self.value.strftime("%Y-%m-%d")
 
+def records_change(method):
+    """Runs `method` under the write lock of the book holding the record, on its latest
+    stored state, and reports the state it had before to the book."""
+
+    @wraps(method)
+    def wrapper(self, *args):
+        book = self.book
+        if book is None:
+            return method(self, *args)
+        with book.lock.writing():
+            book.reload_record(self)
+            before = self.row()
+            result = method(self, *args)
+            book.record_changed(self, before)
+            return result
+
+    return wrapper
+
+
 class Record:
+    """A contact; phones are kept as their `Phone.key` ints, not as Phone objects."""
+    __slots__ = ("name", "keys", "birthday", "book")
+
     def __init__(self, name: Name, phone: Phone = None, birthday: Birthday = None):
         self.name = name
-        self.phones = [phone] if phone else []
+        self.keys = (phone.key,) if phone else ()
         self.birthday = birthday
+        self.book = None
+
+    @property
+    def phones(self) -> list[str]:
+        return [Phone.unpack(key) for key in self.keys]
 
+    @records_change
     def add_phone(self, add_phone: Phone):
-        self.phones.append(add_phone)
+        if add_phone.key not in self.keys:
+            self.keys += (add_phone.key,)
 
+    @records_change
     def remove_phone(self, removable_phone: Phone):
-        self.phones = [n for n in self.phones if n != removable_phone]
+        key = removable_phone.key
+        self.keys = tuple(k for k in self.keys if k != key)
 
+    @records_change
     def change_phone(self, changeable_phone: Phone, new_phone: Phone):
-
-        for i, n in enumerate(self.phones):
-            if n == changeable_phone:
-                self.phones[i] = new_phone
+        key = changeable_phone.key
+        self.keys = self.unique([new_phone.key if k == key else k for k in self.keys])
         return self.phones
 
 
+    @records_change
     def add_phones(self, phones: list[Phone]):
-        self.phones += phones
+        self.keys = self.unique(list(self.keys) + [phone.key for phone in phones])
         return self
 
+    @staticmethod
+    def unique(keys: list[int]) -> tuple[int, ...]:
+        return tuple(dict.fromkeys(keys))
+
+    def row(self) -> tuple:
+        """(name, phones, birthday) as strings, the form journals and change sets use."""
+        return self.name.value, tuple(self.phones), str(self.birthday) if self.birthday else ""
+
+    @staticmethod
+    def from_row(row: tuple) -> "Record":
+        name, phones, birthday = row
+        return Record(
+            Name(name),
+            None,
+            Birthday(birthday) if birthday else None
+        ).add_phones([Phone(p) for p in phones])
 
     def __str__(self):
-        return self.name.value + repr(self.phones) + repr(self.birthday)
+        return self.name.value + "[" + ", ".join(self.phones) + "]" + repr(self.birthday)
 
     def __repr__(self):
         return str(self)
 
 
+class SubstringIndex:
+    """Maps every `gram_size`-character substring to the ids of the names containing it.
+
+    Posting lists are sorted arrays of 4-byte ids. Removing or re-adding a name leaves its
+    old id dead in them until dead ids outnumber live ones and the index is rebuilt.
+    Shorter terms have too many matches for posting lists to pay off, so they are
+    checked against the indexed texts directly.
+    """
+    gram_size = 3
+    separator = "\0"
+
+    def __init__(self):
+        self.postings = {}
+        self.ids = {}
+        self.names = []
+        self.texts = []
+
+    @staticmethod
+    def grams(text: str, size: int) -> set[str]:
+        return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+    def all_grams(self, texts) -> set[str]:
+        grams = set()
+        for text in texts:
+            grams |= self.grams(text, self.gram_size)
+        return grams
+
+    def add(self, name: str, texts: list[str]):
+        self.remove(name)
+        name_id = self.ids[name] = len(self.names)
+        self.names.append(name)
+        self.texts.append(self.separator.join(texts))
+        for gram in self.all_grams(texts):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array('I')
+            postings.append(name_id)
+
+    def remove(self, name: str):
+        name_id = self.ids.pop(name, None)
+        if name_id is None:
+            return
+        self.names[name_id] = None
+        self.texts[name_id] = None
+        if len(self.names) - len(self.ids) > max(len(self.ids), 1024):
+            self.rebuild()
+
+    def rebuild(self):
+        live = [(name, text) for name, text in zip(self.names, self.texts) if name is not None]
+        self.__init__()
+        for name, text in live:
+            self.add(name, text.split(self.separator))
+
+    def candidates(self, term: str) -> set[str]:
+        if not term:
+            return set(self.ids)
+        if len(term) < self.gram_size:
+            return {name for name, text in zip(self.names, self.texts) if name is not None and term in text}
+        lists = sorted((self.postings.get(gram, ()) for gram in self.grams(term, self.gram_size)), key=len)
+        names = set()
+        for name_id in lists[0]:
+            if all(self.contains(postings, name_id) for postings in lists[1:]) and self.names[name_id] is not None:
+                names.add(self.names[name_id])
+        return names
+
+    def estimate(self, term: str, sample_size: int = 256) -> int:
+        """Roughly len(candidates(term)): the smallest posting list, or for shorter terms
+        the share of an evenly spaced sample of texts that contain it."""
+        if len(term) >= self.gram_size:
+            return min(len(self.postings.get(gram, ())) for gram in self.grams(term, self.gram_size))
+        sample = [text for text in self.texts[::max(1, len(self.texts) // sample_size)] if text is not None]
+        if not sample:
+            return 0
+        return len(self.ids) * sum(term in text for text in sample) // len(sample)
+
+    @staticmethod
+    def contains(postings: array, name_id: int) -> bool:
+        position = bisect_left(postings, name_id)
+        return position < len(postings) and postings[position] == name_id
+
+
+class CommandStats:
+    """Per-command calls, errors, output size and a power-of-two latency histogram."""
+    buckets = 40
+
+    def __init__(self):
+        self.commands = {}
+        self.lock = threading.Lock()
+        self.dumper = None
+
+    def record(self, name: str, seconds: float, error: bool = False, output: int = 0):
+        with self.lock:
+            entry = self.commands.get(name)
+            if entry is None:
+                entry = self.commands[name] = {"calls": 0, "errors": 0, "bytes": 0, "histogram": [0] * self.buckets}
+            entry["calls"] += 1
+            entry["errors"] += error
+            entry["bytes"] += output
+            entry["histogram"][min(int(seconds * 1e6).bit_length(), self.buckets - 1)] += 1
+
+    def stream(self, name: str, started: float, chunks):
+        """Passes `chunks` through; an error raised while streaming becomes the last line."""
+        output = 0
+        error = False
+        try:
+            for chunk in chunks:
+                output += len(chunk)
+                yield chunk
+        except IndexError:
+            error = True
+            yield "Sorry, reading from invalid index"
+        except Exception as e:
+            error = True
+            yield str(e)
+        finally:
+            self.record(name, time.perf_counter() - started, error=error, output=output)
+
+    @staticmethod
+    def percentile(histogram: list[int], q: float) -> float:
+        """Upper bound, in milliseconds, of the bucket holding the q-th quantile."""
+        target = sum(histogram) * q
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if count and seen >= target:
+                return 2 ** bucket / 1000
+        return 0.0
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            commands = {name: dict(entry, histogram=list(entry["histogram"])) for name, entry in self.commands.items()}
+        for entry in commands.values():
+            for q in (50, 95, 99):
+                entry[f"p{q}_ms"] = self.percentile(entry["histogram"], q / 100)
+        return commands
+
+    def report(self) -> str:
+        pattern = '{0:16} {1:>8} {2:>8} {3:>10} {4:>10} {5:>10} {6:>12}\n'
+        table = [pattern.format("Command", "Calls", "Errors", "p50 ms", "p95 ms", "p99 ms", "Bytes")]
+        for name, entry in sorted(self.snapshot().items()):
+            table.append(pattern.format(
+                name, entry["calls"], entry["errors"],
+                entry["p50_ms"], entry["p95_ms"], entry["p99_ms"], entry["bytes"]
+            ))
+        return "".join(table)
+
+    def dump(self, filename: str):
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='UTF8') as file:
+            json.dump(self.snapshot(), file, indent=2)
+        os.replace(tmp_filename, filename)
+
+    def start_dump(self, filename: str, interval: float = 60):
+        def run():
+            while True:
+                time.sleep(interval)
+                self.dump(filename)
+
+        self.dumper = threading.Thread(target=run, daemon=True)
+        self.dumper.start()
+
+
+stats = CommandStats()
+
+
+class ResultCache:
+    """LRU of rendered command output; an entry is valid for one version of one AddressBook."""
+
+    def __init__(self, max_entries: int = 256, max_chars: int = 1 << 16):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, version: int):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, version: int, text: str):
+        if len(text) > self.max_chars:
+            return
+        with self.lock:
+            self.entries[key] = (version, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def capture(self, key: tuple, version: int, chunks):
+        """Streams `chunks` and keeps them once complete unless they outgrow `max_chars`."""
+        kept = []
+        size = 0
+        for chunk in chunks:
+            if kept is not None:
+                size += len(chunk)
+                if size <= self.max_chars:
+                    kept.append(chunk)
+                else:
+                    kept = None
+            yield chunk
+        if kept is not None:
+            self.put(key, version, "".join(kept))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def report(self) -> str:
+        return f"Result cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} entries"
+
+
+results = ResultCache()
+
+
+def timed(func):
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.record(name, time.perf_counter() - started)
+
+    return wrapper
+
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree of words for edit-distance lookups."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, word: str):
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = levenshtein(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                self.size += 1
+                return
+            node = child
+
+    def find(self, word: str, max_distance: int) -> list[tuple[int, str]]:
+        found = []
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = levenshtein(word, node_word)
+            if distance <= max_distance:
+                found.append((distance, node_word))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return sorted(found)
+
+
+class PhoneIndex:
+    """Maps every packed phone key to its owner's name, or to a set of names once shared."""
+
+    def __init__(self):
+        self.names_by_phone = {}
+        self.phones_by_name = {}
+        self.shared = set()
+
+    def add(self, name: str, phones: list[int]):
+        self.remove(name)
+        phones = tuple(set(phones))
+        for phone in phones:
+            owners = self.names_by_phone.get(phone)
+            if owners is None:
+                self.names_by_phone[phone] = name
+                continue
+            if isinstance(owners, str):
+                owners = self.names_by_phone[phone] = {owners}
+            owners.add(name)
+            self.shared.add(phone)
+        if phones:
+            self.phones_by_name[name] = phones
+
+    def remove(self, name: str):
+        for phone in self.phones_by_name.pop(name, ()):
+            owners = self.names_by_phone[phone]
+            if isinstance(owners, str):
+                del self.names_by_phone[phone]
+                continue
+            owners.discard(name)
+            if len(owners) == 1:
+                self.names_by_phone[phone] = owners.pop()
+                self.shared.discard(phone)
+
+    def owners(self, phone: int) -> set[str]:
+        owners = self.names_by_phone.get(phone)
+        if owners is None:
+            return set()
+        return {owners} if isinstance(owners, str) else owners
+
+
+class BirthdayCalendar:
+    """Buckets names by the (month, day) of their birthday."""
+
+    def __init__(self):
+        self.names_by_day = defaultdict(set)
+        self.day_by_name = {}
+        self.days = {}
+        self.version = 0
+
+    def add(self, name: str, birthday: Birthday = None):
+        day = (birthday.value.month, birthday.value.day) if birthday is not None else None
+        day = self.days.setdefault(day, day)
+        if self.day_by_name.get(name) == day:
+            return
+        self.remove(name)
+        self.version += 1
+        if day is not None:
+            self.names_by_day[day].add(name)
+            self.day_by_name[name] = day
+
+    def remove(self, name: str):
+        day = self.day_by_name.pop(name, None)
+        if day is not None:
+            self.version += 1
+            names = self.names_by_day[day]
+            names.discard(name)
+            if not names:
+                del self.names_by_day[day]
+
+    @staticmethod
+    def window(today: date, days: int):
+        """(offset, (month, day)) for the next `days` days, each day at its first offset only;
+        Feb 29 birthdays fall on Feb 28 in other years."""
+        seen = set()
+        for offset in range(min(days, 366) + 1):
+            current = today + timedelta(days=offset)
+            buckets = [(current.month, current.day)]
+            if current.month == 2 and current.day == 28 and not isleap(current.year):
+                buckets.append((2, 29))
+            for bucket in buckets:
+                if bucket not in seen:
+                    seen.add(bucket)
+                    yield offset, bucket
+
+    @staticmethod
+    def key(month: int, day: int) -> int:
+        return month * 32 + day
+
+    @classmethod
+    def distance_table(cls, today: date) -> list[int]:
+        """Days until the next occurrence of every month * 32 + day key, starting from `today`."""
+        table = [0] * cls.key(13, 0)
+        for offset, (month, day) in reversed(list(cls.window(today, 366))):
+            table[cls.key(month, day)] = offset
+        return table
+
+    def upcoming(self, today: date, days: int):
+        for offset, bucket in self.window(today, days):
+            for name in sorted(self.names_by_day.get(bucket, ())):
+                yield offset, name
+
+    def count(self, today: date, days: int) -> int:
+        return sum(len(self.names_by_day.get(bucket, ())) for _, bucket in self.window(today, days))
+
+
+class Journal:
+    """Append-only log of record states, fsynced once per `batch_size` entries."""
+
+    def __init__(self, filename: str, batch_size: int = 32):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.entries = 0
+        self.pending = 0
+        self.file = open(filename, 'a', encoding='UTF8', newline='')
+        self.writer = csv.writer(self.file)
+
+    def append(self, record: Record):
+        name, phones, birthday = record.row()
+        self.write([name, " ".join(phones), birthday])
+
+    def append_removal(self, name: str):
+        self.write([name, "", "", "removed"])
+
+    def write(self, row: list[str]):
+        self.writer.writerow(row)
+        self.file.flush()
+        self.entries += 1
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    @staticmethod
+    def parse(line: bytes) -> tuple:
+        name, phones, birthday, *removed = next(csv.reader([line.decode('UTF8')]))
+        return name, None if removed else Record.from_row((name, phones.split(), birthday))
+
+    @staticmethod
+    def replay(filename: str):
+        """Yields (name, record) pairs; the record is None when the name was removed.
+
+        A last row that is unterminated or does not parse was torn by a crash in the
+        middle of a write; it is cut off the file instead of failing the whole replay.
+        """
+        with open(filename, 'rb+') as fh:
+            lines = fh.readlines()
+            offset = 0
+            for number, line in enumerate(lines):
+                last = number == len(lines) - 1
+                try:
+                    if last and not line.endswith(b"\n"):
+                        raise ValueError("unterminated row")
+                    entry = Journal.parse(line)
+                except Exception:
+                    if not last:
+                        raise
+                    fh.truncate(offset)
+                    return
+                yield entry
+                offset += len(line)
+
+
+class BinarySnapshot:
+    """Memory-mapped snapshot: header, name -> offset hash table, then packed records.
+
+    A record is a length-prefixed UTF-8 name, the birthday as a date ordinal (0 for none),
+    the phone count and every phone as its digit count followed by two digits per byte.
+    """
+    magic = b"ABK1"
+    header = struct.Struct("<4sIIQQ")
+    slot = struct.Struct("<Q")
+    name_length = struct.Struct("<H")
+    birthday = struct.Struct("<IB")
+    unpacked_phone = 255
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, 'rb') as fh:
+            self.map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.slots, self.start, self.end = self.header.unpack_from(self.map, 0)
+        if magic != self.magic:
+            raise Exception(f"The file {filename} is not an address book snapshot")
+
+    @staticmethod
+    def slot_of(name: bytes, slots: int) -> int:
+        return zlib.crc32(name) % slots
+
+    def name_at(self, offset: int) -> bytes:
+        (length,) = self.name_length.unpack_from(self.map, offset)
+        return self.map[offset + 2:offset + 2 + length]
+
+    def lookup(self, name: str):
+        encoded = name.encode('UTF8')
+        slot = self.slot_of(encoded, self.slots)
+        while True:
+            (offset,) = self.slot.unpack_from(self.map, self.header.size + slot * self.slot.size)
+            if offset == 0:
+                return None
+            if self.name_at(offset) == encoded:
+                return offset
+            slot = (slot + 1) % self.slots
+
+    def entries(self):
+        offset = self.start
+        while offset < self.end:
+            name = self.name_at(offset)
+            yield name.decode('UTF8'), offset
+            offset = self.skip(offset)
+
+    def skip(self, offset: int) -> int:
+        offset += 2 + len(self.name_at(offset))
+        _, phone_count = self.birthday.unpack_from(self.map, offset)
+        offset += self.birthday.size
+        for _ in range(phone_count):
+            length = self.map[offset]
+            if length == self.unpacked_phone:
+                offset += 2 + self.map[offset + 1]
+            else:
+                offset += 1 + (length + 1) // 2
+        return offset
+
+    def record_at(self, offset: int) -> Record:
+        name = self.name_at(offset).decode('UTF8')
+        offset += 2 + len(name.encode('UTF8'))
+        ordinal, phone_count = self.birthday.unpack_from(self.map, offset)
+        offset += self.birthday.size
+        keys = []
+        for _ in range(phone_count):
+            length = self.map[offset]
+            if length == self.unpacked_phone:
+                size = self.map[offset + 1]
+                keys.append(Phone(self.map[offset + 2:offset + 2 + size].decode('UTF8')).key)
+                offset += 2 + size
+            else:
+                size = (length + 1) // 2
+                keys.append(Phone.pack(self.map[offset + 1:offset + 1 + size].hex()[:length]))
+                offset += 1 + size
+        record = Record(
+            Name(name),
+            None,
+            Birthday(date.fromordinal(ordinal).isoformat()) if ordinal else None
+        )
+        record.keys = Record.unique(keys)
+        return record
+
+    @classmethod
+    def pack(cls, name: str, phones: list[str], birthday: date) -> bytes:
+        encoded = name.encode('UTF8')
+        packed = [
+            cls.name_length.pack(len(encoded)),
+            encoded,
+            cls.birthday.pack(birthday.toordinal() if birthday else 0, len(phones))
+        ]
+        for phone in phones:
+            if phone.isascii() and phone.isdigit() and len(phone) < cls.unpacked_phone:
+                packed.append(bytes([len(phone)]) + bytes.fromhex(phone + "0" * (len(phone) % 2)))
+            else:
+                encoded_phone = phone.encode('UTF8')
+                packed.append(bytes([cls.unpacked_phone, len(encoded_phone)]) + encoded_phone)
+        return b"".join(packed)
+
+    @classmethod
+    def write(cls, filename: str, rows: list[tuple]):
+        slots = 1
+        while slots < len(rows) * 2:
+            slots *= 2
+        start = cls.header.size + slots * cls.slot.size
+        table = bytearray(slots * cls.slot.size)
+        records = bytearray()
+        for row in rows:
+            offset = start + len(records)
+            slot = cls.slot_of(row[0].encode('UTF8'), slots)
+            while cls.slot.unpack_from(table, slot * cls.slot.size)[0]:
+                slot = (slot + 1) % slots
+            cls.slot.pack_into(table, slot * cls.slot.size, offset)
+            records += row[1] if len(row) == 2 else cls.pack(*row)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as file:
+            file.write(cls.header.pack(cls.magic, len(rows), slots, start, start + len(records)))
+            file.write(table)
+            file.write(records)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, filename)
+
+    def close(self):
+        self.map.close()
+
+
+class SnapshotOffsets:
+    """Offsets of the snapshot records that have not been materialized yet."""
+
+    def __init__(self, snapshot: BinarySnapshot):
+        self.snapshot = snapshot
+        self.taken = set()
+
+    def __contains__(self, name: str) -> bool:
+        return name not in self.taken and self.snapshot.lookup(name) is not None
+
+    def __getitem__(self, name: str) -> int:
+        offset = None if name in self.taken else self.snapshot.lookup(name)
+        if offset is None:
+            raise KeyError(name)
+        return offset
+
+    def __len__(self) -> int:
+        return self.snapshot.count - len(self.taken)
+
+    def __iter__(self):
+        for name, _ in self.items():
+            yield name
+
+    def items(self):
+        for name, offset in self.snapshot.entries():
+            if name not in self.taken:
+                yield name, offset
+
+    def copy(self):
+        offsets = SnapshotOffsets(self.snapshot)
+        offsets.taken = set(self.taken)
+        return offsets
+
+    def pop(self, name: str, *default):
+        offset = None if name in self.taken else self.snapshot.lookup(name)
+        if offset is None:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        self.taken.add(name)
+        return offset
+
+
+class ReadWriteLock:
+    """Many readers or one re-entrant writer; a waiting writer holds back new readers."""
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.writer_depth = 0
+        self.waiting_writers = 0
+
+    @contextmanager
+    def reading(self):
+        with self.condition:
+            if self.writer != threading.get_ident():
+                while self.writer is not None or self.waiting_writers:
+                    self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.writer_depth += 1
+            else:
+                self.waiting_writers += 1
+                while self.writer is not None or self.readers:
+                    self.condition.wait()
+                self.waiting_writers -= 1
+                self.writer = me
+                self.writer_depth = 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer_depth -= 1
+                if not self.writer_depth:
+                    self.writer = None
+                    self.condition.notify_all()
+
+
+open_shards = {}
+
+
+def load_shard(path: str) -> str:
+    """Text of the shard at `path`, cached per process for the latest build directory only,
+    so a rebuild drops the shards of the previous one."""
+    directory = os.path.dirname(path)
+    shards = open_shards.get(directory)
+    if shards is None:
+        open_shards.clear()
+        shards = open_shards[directory] = {}
+    shard = shards.get(path)
+    if shard is None:
+        with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            shard = shards[path] = mapped[:].decode('UTF8')
+    return shard
+
+
+def scan_shard(path: str, pattern: str, regex: bool) -> list[str]:
+    """Names of the shard lines that match `pattern`, in shard order."""
+    shard = load_shard(path)
+    compiled = re.compile(pattern, re.MULTILINE) if regex else None
+    names = []
+    position = 0
+    while position < len(shard):
+        if regex:
+            match = compiled.search(shard, position)
+            found = match.start() if match else -1
+        else:
+            found = shard.find(pattern, position)
+        if found < 0:
+            break
+        start = shard.rfind("\n", 0, found) + 1
+        end = shard.find("\n", found)
+        names.append(shard[start:shard.find("\t", start)])
+        position = end + 1 if end >= 0 else len(shard)
+    return names
+
+
+class ShardedScanner:
+    """Splits the book into text shard files that a process pool scans in parallel."""
+
+    def __init__(self, shards: int = None):
+        self.shards = shards or os.cpu_count() or 1
+        self.directory = None
+        self.paths = []
+        self.version = None
+        self.executor = None
+
+    def build(self, records: list[Record], version: int):
+        self.remove_files()
+        self.directory = tempfile.mkdtemp(prefix="addressbook-shards-")
+        size = -(-len(records) // self.shards) or 1
+        self.paths = []
+        for number, start in enumerate(range(0, max(len(records), 1), size)):
+            path = os.path.join(self.directory, f"shard{number}")
+            with open(path, 'wb') as file:
+                file.write("".join(
+                    f"{record.name.value}\t{' '.join(record.phones)}\n"
+                    for record in records[start:start + size]
+                ).encode('UTF8') or b"\n")
+            self.paths.append(path)
+        self.version = version
+
+    def scan(self, pattern: str, regex: bool = True):
+        if len(self.paths) == 1:
+            yield from scan_shard(self.paths[0], pattern, regex)
+            return
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.shards)
+        for names in self.executor.map(scan_shard, self.paths, repeat(pattern), repeat(regex)):
+            yield from names
+
+    def remove_files(self):
+        if self.directory is not None:
+            open_shards.pop(self.directory, None)
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.remove_files()
+
+
+class Storage:
+    """Persistent record store that AddressBook pushes lookups and queries down to."""
+
+    def names(self):
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def contains(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def get(self, name: str) -> Record:
+        raise NotImplementedError
+
+    def put(self, record: Record):
+        raise NotImplementedError
+
+    def put_many(self, records: list[Record]):
+        for record in records:
+            self.put(record)
+
+    def remove(self, name: str):
+        raise NotImplementedError
+
+    def search(self, term: str) -> list[str]:
+        raise NotImplementedError
+
+    def phone_owners(self, phone: str) -> list[str]:
+        raise NotImplementedError
+
+    def shared_phones(self) -> dict[str, list[str]]:
+        raise NotImplementedError
+
+    def upcoming(self, today: date, days: int):
+        raise NotImplementedError
+
+    def count_search(self, term: str) -> int:
+        raise NotImplementedError
+
+    def count_phone_owners(self, phone: str) -> int:
+        raise NotImplementedError
+
+    def count_upcoming(self, today: date, days: int) -> int:
+        raise NotImplementedError
+
+    def birthday_keys(self) -> tuple[list[str], list[int]]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SqliteStorage(Storage):
+    """Records, phones and birthdays in normalized SQLite tables with indexes."""
+
+    def __init__(self, filename: str = 'addressbook.db'):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS records (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    birthday TEXT,
+                    birthday_key INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS phones (
+                    record_id INTEGER NOT NULL REFERENCES records(id) ON DELETE CASCADE,
+                    phone TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS phones_phone ON phones(phone);
+                CREATE INDEX IF NOT EXISTS phones_record ON phones(record_id);
+                CREATE INDEX IF NOT EXISTS records_birthday ON records(birthday_key);
+            """)
+        try:
+            with self.connection:
+                self.connection.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS search_text USING fts5(text, tokenize='trigram')"
+                )
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def names(self):
+        for (name,) in self.connection.execute("SELECT name FROM records ORDER BY id"):
+            yield name
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT count(*) FROM records").fetchone()[0]
+
+    def contains(self, name: str) -> bool:
+        return self.connection.execute("SELECT 1 FROM records WHERE name = ?", (name,)).fetchone() is not None
+
+    def get(self, name: str) -> Record:
+        row = self.connection.execute("SELECT id, birthday FROM records WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        record_id, birthday = row
+        phones = self.connection.execute(
+            "SELECT phone FROM phones WHERE record_id = ? ORDER BY rowid", (record_id,)
+        )
+        return Record(
+            Name(name),
+            None,
+            Birthday(birthday) if birthday else None
+        ).add_phones([Phone(phone) for (phone,) in phones])
+
+    def _put(self, record: Record):
+        name = record.name.value
+        birthday = record.birthday.value if record.birthday else None
+        self.connection.execute(
+            "INSERT INTO records (name, birthday, birthday_key) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET birthday = excluded.birthday, birthday_key = excluded.birthday_key",
+            (name, birthday.isoformat() if birthday else None, birthday.month * 100 + birthday.day if birthday else None)
+        )
+        record_id = self.connection.execute("SELECT id FROM records WHERE name = ?", (name,)).fetchone()[0]
+        self.connection.execute("DELETE FROM phones WHERE record_id = ?", (record_id,))
+        self.connection.executemany(
+            "INSERT INTO phones (record_id, phone) VALUES (?, ?)",
+            [(record_id, phone) for phone in record.phones]
+        )
+        if self.fts:
+            self.connection.execute("DELETE FROM search_text WHERE rowid = ?", (record_id,))
+            self.connection.execute(
+                "INSERT INTO search_text (rowid, text) VALUES (?, ?)",
+                (record_id, "\n".join([name] + record.phones))
+            )
+
+    def put(self, record: Record):
+        with self.connection:
+            self._put(record)
+
+    def put_many(self, records: list[Record]):
+        with self.connection:
+            for record in records:
+                self._put(record)
+
+    def remove(self, name: str):
+        with self.connection:
+            row = self.connection.execute("SELECT id FROM records WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return
+            self.connection.execute("DELETE FROM phones WHERE record_id = ?", row)
+            if self.fts:
+                self.connection.execute("DELETE FROM search_text WHERE rowid = ?", row)
+            self.connection.execute("DELETE FROM records WHERE id = ?", row)
+
+    def search(self, term: str) -> list[str]:
+        if self.fts and len(term) >= 3:
+            rows = self.connection.execute(
+                "SELECT records.name FROM search_text JOIN records ON records.id = search_text.rowid "
+                "WHERE search_text MATCH ? ORDER BY records.name",
+                ('"' + term.replace('"', '""') + '"',)
+            )
+        else:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            rows = self.connection.execute(
+                "SELECT name FROM records WHERE name LIKE ? ESCAPE '\\' "
+                "OR id IN (SELECT record_id FROM phones WHERE phone LIKE ? ESCAPE '\\') ORDER BY name",
+                (pattern, pattern)
+            )
+        return [name for (name,) in rows]
+
+    def phone_owners(self, phone: str) -> list[str]:
+        rows = self.connection.execute(
+            "SELECT DISTINCT records.name FROM phones JOIN records ON records.id = phones.record_id "
+            "WHERE phones.phone = ? ORDER BY records.name",
+            (phone,)
+        )
+        return [name for (name,) in rows]
+
+    def shared_phones(self) -> dict[str, list[str]]:
+        rows = self.connection.execute(
+            "SELECT phones.phone, records.name FROM phones JOIN records ON records.id = phones.record_id "
+            "WHERE phones.phone IN (SELECT phone FROM phones GROUP BY phone HAVING count(DISTINCT record_id) > 1) "
+            "ORDER BY phones.phone, records.name"
+        )
+        shared = defaultdict(list)
+        for phone, name in rows:
+            if name not in shared[phone]:
+                shared[phone].append(name)
+        return dict(shared)
+
+    def upcoming(self, today: date, days: int):
+        offsets = defaultdict(list)
+        for offset, (month, day) in BirthdayCalendar.window(today, days):
+            offsets[month * 100 + day].append(offset)
+        keys = list(offsets)
+        rows = self.connection.execute(
+            f"SELECT name, birthday_key FROM records WHERE birthday_key IN ({', '.join('?' * len(keys))})",
+            keys
+        )
+        found = sorted((offset, name) for name, key in rows for offset in offsets[key])
+        yield from found
+
+    def count_search(self, term: str, sample_size: int = 256) -> int:
+        """Roughly len(search(term)); without the trigram index it is scaled up from a sample."""
+        if self.fts and len(term) >= 3:
+            return self.connection.execute(
+                "SELECT count(*) FROM search_text WHERE search_text MATCH ?", ('"' + term.replace('"', '""') + '"',)
+            ).fetchone()[0]
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        total = self.count()
+        found = self.connection.execute(
+            "SELECT count(*) FROM (SELECT id, name FROM records ORDER BY id LIMIT ?) "
+            "WHERE name LIKE ? ESCAPE '\\' OR id IN (SELECT record_id FROM phones WHERE phone LIKE ? ESCAPE '\\')",
+            (sample_size, pattern, pattern)
+        ).fetchone()[0]
+        return total * found // max(min(total, sample_size), 1)
+
+    def count_phone_owners(self, phone: str) -> int:
+        return self.connection.execute(
+            "SELECT count(DISTINCT record_id) FROM phones WHERE phone = ?", (phone,)
+        ).fetchone()[0]
+
+    def count_upcoming(self, today: date, days: int) -> int:
+        keys = [month * 100 + day for _, (month, day) in BirthdayCalendar.window(today, days)]
+        return self.connection.execute(
+            f"SELECT count(*) FROM records WHERE birthday_key IN ({', '.join('?' * len(keys))})", keys
+        ).fetchone()[0]
+
+    def birthday_keys(self) -> tuple[list[str], list[int]]:
+        names = []
+        keys = []
+        for name, key in self.connection.execute(
+            "SELECT name, birthday_key FROM records WHERE birthday_key IS NOT NULL"
+        ):
+            names.append(name)
+            keys.append(BirthdayCalendar.key(key // 100, key % 100))
+        return names, keys
+
+    def close(self):
+        self.connection.close()
+
+
 class AddressBook(UserDict[str, Record]):
+    max_history = 100000
+    version_block = 1000
+    compact_share = 10
+
+    def __init__(self, filename: str = 'addressbook.csv', compact_after: int = 1000):
+        self.index = SubstringIndex()
+        self.calendar = BirthdayCalendar()
+        self.phone_index = PhoneIndex()
+        self.names_tree = BKTree()
+        self.names_tree_complete = False
+        self.names_tree_pending = None
+        self.names_tree_building = threading.Lock()
+        self.filename = filename
+        self.journal_filename = os.path.splitext(filename)[0] + '.journal'
+        self.journal = None
+        self.compact_after = compact_after
+        self.compaction = None
+        self.compaction_requested = False
+        self.dirty = set()
+        self.batch = None
+        self.lock = ReadWriteLock()
+        self.autosave = None
+        self.autosave_threshold = 100
+        self.autosave_stopping = False
+        self.wakeup = threading.Event()
+        self.offsets = {}
+        self.snapshot = None
+        self.storage = None
+        self.version = 0
+        self.scanner = None
+        self.birthday_columns = None
+        self.birthday_cache = None
+        self.history = []
+        self.history_floor = 0
+        self.versions_filename = None
+        self.versions_reserved = 0
+        super().__init__()
+
+    def __len__(self):
+        if self.storage is not None:
+            return self.storage.count()
+        return len(self.data) + len(self.offsets)
+
+    def __iter__(self):
+        if self.storage is not None:
+            yield from self.storage.names()
+            return
+        yield from self.data
+        yield from list(self.offsets)
+
+    def __contains__(self, name):
+        if name in self.data or name in self.offsets:
+            return True
+        if self.storage is None:
+            return False
+        batch = self.batch
+        if batch is not None and name in batch:
+            return batch[name] is not None
+        return self.storage.contains(name)
+
+    def __missing__(self, name):
+        if name in self.offsets:
+            return self.materialize(name)
+        if self.storage is not None:
+            batch = self.batch
+            if batch is not None and name in batch:
+                if batch[name] is None:
+                    raise KeyError(name)
+                return batch[name]
+            record = self.storage.get(name)
+            if record is not None:
+                record.book = self
+                return record
+        raise KeyError(name)
+
+    def open_storage(self, storage: Storage):
+        """Keeps records in `storage`, which answers lookups and queries; records are
+        fetched per access and neither cached nor indexed in memory."""
+        self.storage = storage
+        self.storage.put_many(self.data.values())
+        self.data.clear()
+        self.index = SubstringIndex()
+        self.calendar = BirthdayCalendar()
+        self.phone_index = PhoneIndex()
+        self.open_versions(storage.filename + '.version')
+        self.history_floor = self.version
+
+    def open_versions(self, filename: str):
+        """Continues numbering after every version an earlier session may have handed out,
+        so a `since` from before a restart is recognised rather than silently reused."""
+        self.versions_filename = filename
+        reserved = 0
+        if os.path.exists(filename):
+            with open(filename, encoding='UTF8') as fh:
+                reserved = int(fh.read() or 0)
+        self.version = max(self.version, reserved) + 1
+        self.reserve_versions()
+
+    def reserve_versions(self):
+        self.versions_reserved = self.version + self.version_block
+        tmp_filename = self.versions_filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='UTF8') as fh:
+            fh.write(str(self.versions_reserved))
+        os.replace(tmp_filename, self.versions_filename)
+
+    def next_version(self) -> int:
+        self.version += 1
+        if self.versions_filename is not None and self.version > self.versions_reserved:
+            self.reserve_versions()
+        return self.version
+
+    def remember(self, name: str, before: tuple):
+        """Keeps `before` as the state of `name` preceding the current version."""
+        self.history.append((self.version, name, before))
+        if len(self.history) > self.max_history:
+            cut = len(self.history) - self.max_history // 2
+            self.history_floor = self.history[cut - 1][0]
+            del self.history[:bisect_right(self.history, self.history_floor, key=itemgetter(0))]
+
     def add_record(self, record: Record) -> None:
-        self.data[record.name.value] = record
+        name = record.name.value
+        with self.lock.writing():
+            previous = self.data.get(name)
+            if previous is None and (name in self.offsets or self.storage is not None):
+                previous = self.get(name)
+            self.offsets.pop(name, None)
+            if self.storage is None:
+                self.data[name] = record
+            if previous is not None and previous is not record:
+                previous.book = None
+            record.book = self
+            self.record_changed(record, previous.row() if previous is not None else None)
+
+    def reload_record(self, record: Record):
+        """Brings a copy fetched from storage up to date; other writers may have stored a
+        newer state of it since. Raises KeyError when the record was removed meanwhile."""
+        if self.storage is None:
+            return
+        current = self[record.name.value]
+        if current is not record:
+            record.keys, record.birthday = current.keys, current.birthday
+
+    def remove_record(self, name: str):
+        with self.lock.writing():
+            record = self[name]
+            self.data.pop(name, None)
+            record.book = None
+            self.log_change(name, record.row(), None)
 
     def change_record(self, record: Record):
-        if record.name.value in self.data:
-            self.data[record.name.value] = record
+        if record.name.value in self:
+            self.add_record(record)
         else:
             raise Exception(f"This name {record.name.value} is not found. Please input correct name")
 
+    def index_name(self, name: str):
+        if self.names_tree_complete:
+            self.names_tree.add(name)
+        elif self.names_tree_pending is not None:
+            self.names_tree_pending.append(name)
+
+    def index_record(self, record: Record):
+        self.index_name(record.name.value)
+        if self.storage is not None:
+            return
+        self.index.add(record.name.value, [record.name.value] + record.phones)
+        self.calendar.add(record.name.value, record.birthday)
+        self.phone_index.add(record.name.value, record.keys)
+
+    def record_changed(self, record: Record, before: tuple = None):
+        self.log_change(record.name.value, before, record)
+
+    def log_change(self, name: str, before: tuple, record: Record = None):
+        """Indexes and persists the new state of `name` (None when removed) and remembers
+        `before` as its state at the previous version."""
+        with self.lock.writing():
+            if record is not None:
+                self.index_record(record)
+            else:
+                self.index.remove(name)
+                self.calendar.remove(name)
+                self.phone_index.remove(name)
+            self.next_version()
+            self.remember(name, before)
+            if self.batch is not None:
+                self.batch[name] = record
+            elif self.storage is not None:
+                if record is not None:
+                    self.storage.put(record)
+                else:
+                    self.storage.remove(name)
+            if self.journal is not None:
+                self.dirty.add(name)
+        if self.journal is None or self.batch is not None:
+            return
+        if self.autosave is None:
+            self.flush()
+        elif len(self.dirty) >= self.autosave_threshold:
+            self.wakeup.set()
+
+    @contextmanager
+    def transaction(self):
+        """Groups changes: one storage commit and one journal flush for the whole block."""
+        if self.batch is not None:
+            yield
+            return
+        with self.lock.writing():
+            self.batch = {}
+            try:
+                yield
+            finally:
+                batch, self.batch = self.batch, None
+                if self.storage is not None and batch:
+                    self.storage.put_many([record for record in batch.values() if record is not None])
+                    for name in [name for name, record in batch.items() if record is None]:
+                        self.storage.remove(name)
+        if self.journal is None or not self.dirty:
+            return
+        if self.autosave is None:
+            self.flush()
+        else:
+            self.wakeup.set()
+
+    def flush(self):
+        """Appends the current state of every dirty record to the journal."""
+        with self.lock.writing():
+            dirty, self.dirty = self.dirty, set()
+            records = [(name, self.data.get(name)) for name in dirty]
+        for name, record in records:
+            if record is not None:
+                self.journal.append(record)
+            else:
+                self.journal.append_removal(name)
+        if self.autosave is not None:
+            self.journal.sync()
+        if self.journal.entries >= max(self.compact_after, len(self) // self.compact_share):
+            self.request_compaction()
+
+    def request_compaction(self):
+        if self.autosave is None:
+            self.compact()
+        else:
+            self.compaction_requested = True
+            self.wakeup.set()
+
+    def start_autosave(self, interval: float = 5.0, threshold: int = 100):
+        """Moves journal writes and compaction to a worker that runs every `interval`
+        seconds or after `threshold` changes, so the prompt never waits for the disk."""
+        self.autosave_threshold = threshold
+        self.autosave_stopping = False
+
+        def run():
+            while not self.autosave_stopping:
+                self.wakeup.wait(interval)
+                self.wakeup.clear()
+                self.flush()
+                if self.compaction_requested:
+                    self.compaction_requested = False
+                    self.compact()
+
+        self.autosave = threading.Thread(target=run, daemon=True)
+        self.autosave.start()
+
+    def stop_autosave(self):
+        if self.autosave is None:
+            return
+        self.autosave_stopping = True
+        self.wakeup.set()
+        self.autosave.join()
+        self.autosave = None
+        self.flush()
+
     def iterator(self, page_size: int) -> list[Record]:
-        page = [None] * page_size
-        idx = 0
-        for record in self.data.values():
-            page[idx] = record
-            idx += 1
-            if idx == page_size:
-                yield page
-                idx = 0
-        yield page[:idx]
+        """Pages over the book taking one page of names at a time under the read lock, so
+        neither memory nor the time to the first page grows with the book. Rows not loaded
+        yet are decoded for the page without being kept. When the book changes between
+        pages, the scan restarts and skips as many names as were shown. Rows not loaded yet
+        come first and new records are appended, so only removing or loading a record
+        already shown shifts the following pages, by one."""
+        if self.storage is not None:
+            yield from chunked((self[name] for name in self.storage.names()), page_size)
+            return
+        names = None
+        stamp = None
+        shown = 0
+        while True:
+            with self.lock.reading():
+                current = (self.version, len(self.data), len(self.offsets))
+                if current != stamp:
+                    stamp = current
+                    names = islice(chain(self.offsets, self.data), shown, None)
+                page = self.peek_many(list(islice(names, page_size)))
+            if not page:
+                return
+            shown += len(page)
+            yield page
+            if len(page) < page_size:
+                return
+
+    def peek_many(self, names: list[str]) -> list[Record]:
+        """Records of `names` without loading the ones still in the snapshot or CSV file into
+        the book; call with the lock held."""
+        records = []
+        with open(self.filename, 'rb') if self.offsets and self.snapshot is None else nullcontext() as fh:
+            for name in names:
+                record = self.data.get(name)
+                records.append(record if record is not None else self.read_record(self.offsets[name], fh))
+        return records
+
+    def read_record(self, offset: int, fh=None) -> Record:
+        """Decodes the record at `offset` of the snapshot, or of the CSV file open as `fh`."""
+        if self.snapshot is not None:
+            return self.snapshot.record_at(offset)
+        _, row = next(self.csv_rows(fh, offset))
+        return self.csv_record(row)
 
     def search(self, term: str):
-        for record in self.data.values():
+        self.materialize_all()
+        if self.storage is not None:
+            records = (self[name] for name in self.storage.search(term))
+        else:
+            with self.lock.reading():
+                records = [self.data[name] for name in sorted(self.index.candidates(term))]
+        for record in records:
             if term in record.name.value:
                 yield record
             else:
                 for phone in record.phones:
-                    if term in str(phone):
+                    if term in phone:
                         yield record
                         break
 
-    def write_to_csv(self):
-        with open('addressbook.csv', 'w', encoding='UTF8', newline='') as file:
-            fieldnames = ["Name", "Phones", "Birthday"]
-            writer = csv.DictWriter(
-                file, fieldnames=fieldnames)
-            writer.writeheader()
-            for record in self.data.values():
-                writer.writerow({
-                    "Name": record.name,
-                    "Phones": record.phones,
-                    "Birthday": record.birthday
-                })
-
-    def load_from_csv(self):
-        with open('addressbook.csv', newline='') as fh:
+    def scan(self, pattern: str, regex: bool = True, shards: int = None):
+        """Full scan of names and phones, fanned out over one shard per CPU."""
+        self.materialize_all()
+        if self.scanner is None:
+            self.scanner = ShardedScanner(shards)
+        if self.scanner.version != self.version:
+            if self.storage is not None:
+                records = list(self.values())
+            else:
+                with self.lock.reading():
+                    records = list(self.data.values())
+            self.scanner.build(records, self.version)
+        for name in self.scanner.scan(pattern, regex):
+            record = self.get(name)
+            if record is not None:
+                yield record
+
+    def build_names_tree(self):
+        """Builds the BK-tree from a snapshot of the names without holding the book's lock,
+        then swaps it in together with the names added while it was being built."""
+        with self.names_tree_building:
+            if self.names_tree_complete:
+                return
+            with self.lock.reading():
+                self.names_tree_pending = []
+                names = list(self)
+            tree = BKTree()
+            for name in names:
+                tree.add(name)
+            with self.lock.writing():
+                for name in self.names_tree_pending:
+                    tree.add(name)
+                self.names_tree = tree
+                self.names_tree_pending = None
+                self.names_tree_complete = True
+
+    def fuzzy_search(self, term: str, max_distance: int = 2) -> list[tuple[int, str]]:
+        if not self.names_tree_complete:
+            self.build_names_tree()
+        with self.lock.reading():
+            found = self.names_tree.find(term, max_distance)
+        return [(distance, name) for distance, name in found if name in self]
+
+    def has_phone(self, name: str, phone: Phone) -> bool:
+        record = self.get(name)
+        if self.storage is not None:
+            return record is not None and phone.key in record.keys
+        with self.lock.reading():
+            return record is not None and name in self.phone_index.owners(phone.key)
+
+    def phone_owners(self, phone: Phone) -> list[Record]:
+        if self.storage is not None:
+            return [self[name] for name in self.storage.phone_owners(phone.value)]
+        self.materialize_all()
+        with self.lock.reading():
+            return [self.data[name] for name in sorted(self.phone_index.owners(phone.key))]
+
+    def duplicate_phones(self) -> dict[str, list[str]]:
+        if self.storage is not None:
+            return self.storage.shared_phones()
+        self.materialize_all()
+        with self.lock.reading():
+            return {
+                Phone.unpack(key): sorted(self.phone_index.owners(key))
+                for key in sorted(self.phone_index.shared, key=Phone.unpack)
+            }
+
+    def upcoming_birthdays(self, days: int, today: date = None):
+        today = today or date.today()
+        if self.storage is not None:
+            for offset, name in self.storage.upcoming(today, days):
+                yield offset, self[name]
+            return
+        self.materialize_all()
+        with self.lock.reading():
+            upcoming = [(offset, self.data[name]) for offset, name in self.calendar.upcoming(today, days)]
+        yield from upcoming
+
+    def days_to_birthdays(self, today: date = None) -> dict[str, int]:
+        """Days to the next birthday of every contact that has one, cached until tomorrow
+        or until a birthday changes."""
+        today = today or date.today()
+        if self.storage is not None:
+            stamp = ("storage", self.version)
+        else:
+            self.materialize_all()
+            stamp = self.calendar.version
+        if self.birthday_cache is not None and self.birthday_cache[0] == (today, stamp):
+            return self.birthday_cache[1]
+        if self.birthday_columns is None or self.birthday_columns[0] != stamp:
+            if self.storage is not None:
+                names, keys = self.storage.birthday_keys()
+            else:
+                with self.lock.reading():
+                    names = list(self.calendar.day_by_name)
+                    keys = [BirthdayCalendar.key(*self.calendar.day_by_name[name]) for name in names]
+            keys = numpy.asarray(keys, dtype=numpy.int16) if numpy is not None else array('H', keys)
+            self.birthday_columns = (stamp, names, keys)
+        _, names, keys = self.birthday_columns
+        table = BirthdayCalendar.distance_table(today)
+        if numpy is not None:
+            days = numpy.asarray(table, dtype=numpy.int16)[keys].tolist()
+        else:
+            days = list(map(table.__getitem__, keys))
+        result = dict(zip(names, days))
+        self.birthday_cache = ((today, stamp), result)
+        return result
+
+    def by_upcoming_birthday(self, today: date = None):
+        days = self.days_to_birthdays(today)
+        for name in sorted(days, key=days.__getitem__):
+            yield self[name]
+        for name in list(self):
+            if name not in days:
+                yield self[name]
+
+    def snapshot_rows(self) -> list[tuple]:
+        self.materialize_all()
+        return self.rows_of(self.values())
+
+    @staticmethod
+    def rows_of(records) -> list[tuple]:
+        return [
+            (
+                record.name.value,
+                record.phones,
+                record.birthday.value if record.birthday else None
+            )
+            for record in records
+        ]
+
+    def unloaded_rows(self, offsets) -> list[tuple]:
+        """(name, raw row) for each record of `offsets`, copied from the snapshot or CSV file
+        without decoding it."""
+        if isinstance(offsets, SnapshotOffsets):
+            snapshot = offsets.snapshot
+            return [(name, snapshot.map[offset:snapshot.skip(offset)]) for name, offset in offsets.items()]
+        if not offsets:
+            return []
+        names = {offset: name for name, offset in offsets.items()}
+        rows = []
+        with open(self.filename, 'rb') as fh:
+            if self.fieldnames != ["Name", "Phones", "Birthday"]:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for offset, row in self.csv_rows(fh):
+                    if offset in names:
+                        name, phones, birthday = self.csv_record(row).row()
+                        writer.writerow([name, "[" + ", ".join(phones) + "]", birthday])
+                        rows.append((names[offset], buffer.getvalue().encode('UTF8')))
+                        buffer.seek(0)
+                        buffer.truncate()
+                return rows
+            starts = [offset for offset, _ in self.csv_rows(fh)]
+            ends = starts[1:] + [fh.seek(0, os.SEEK_END)]
+            for start, end in zip(starts, ends):
+                if start in names:
+                    fh.seek(start)
+                    line = fh.read(end - start)
+                    rows.append((names[start], line if line.endswith(b"\n") else line + b"\r\n"))
+        return rows
+
+    def save(self, rows: list[tuple] = None, filename: str = None):
+        """Writes `rows`, every record by default, to `filename`, the book's file by default.
+        A row may be a (name, raw row) pair copied from the current file; for a CSV file the
+        offsets of those rows in the new file are returned."""
+        rows = self.snapshot_rows() if rows is None else rows
+        if self.filename.endswith('.bin'):
+            BinarySnapshot.write(filename or self.filename, rows)
+            return {}
+        return self.write_to_csv(rows, filename)
+
+    def write_to_csv(self, rows: list[tuple] = None, filename: str = None) -> dict:
+        rows = self.snapshot_rows() if rows is None else rows
+        filename = filename or self.filename
+        tmp_filename = filename + '.tmp'
+        offsets = {}
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["Name", "Phones", "Birthday"])
+        with open(tmp_filename, 'wb') as file:
+            for row in rows:
+                if len(row) == 3:
+                    name, phones, birthday = row
+                    writer.writerow([name, "[" + ", ".join(phones) + "]", birthday.isoformat() if birthday else ""])
+                    if buffer.tell() < 65536:
+                        continue
+                file.write(buffer.getvalue().encode('UTF8'))
+                buffer.seek(0)
+                buffer.truncate()
+                if len(row) == 2:
+                    offsets[row[0]] = file.tell()
+                    file.write(row[1])
+            file.write(buffer.getvalue().encode('UTF8'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, filename)
+        return offsets
+
+    def load_snapshot(self):
+        """Maps a binary snapshot; records are decoded from it on first access."""
+        self.snapshot = BinarySnapshot(self.filename)
+        self.offsets = SnapshotOffsets(self.snapshot)
+
+    @staticmethod
+    def record_from_row(row: dict) -> Record:
+        birthday = row["Birthday"]
+        phones = row["Phones"]
+        if isinstance(phones, str):
+            phones = phones[1:-1].split(", ")
+        phones = [Phone(p) for p in phones if p]
+        return Record(
+            Name(row["Name"]),
+            None,
+            Birthday(birthday) if birthday else None
+        ).add_phones(phones)
+
+    @timed
+    def load_from_csv(self, lazy: bool = False):
+        """With `lazy` only the byte offset of each row is read; records are built on first access."""
+        if lazy:
+            self.offsets = {}
+            with open(self.filename, 'rb') as fh:
+                rows = self.csv_rows(fh)
+                _, self.fieldnames = next(rows, (0, ["Name", "Phones", "Birthday"]))
+                for offset, row in rows:
+                    if row[0] not in self.data:
+                        self.offsets[row[0]] = offset
+            return
+        with open(self.filename, newline='') as fh, self.lock.writing():
+            for row in csv.DictReader(fh):
+                record = self.record_from_row(row)
+                self.data[record.name.value] = record
+                record.book = self
+                self.index_record(record)
+
+    @staticmethod
+    def csv_rows(fh, offset: int = 0):
+        """(byte offset, row) for each non-empty CSV row of the binary file `fh` from `offset`;
+        a quoted field may span lines."""
+        fh.seek(offset)
+        position = offset
+
+        def lines():
+            nonlocal position
+            for line in fh:
+                position += len(line)
+                yield line.decode('UTF8')
+
+        reader = csv.reader(lines())
+        while True:
+            start = position
+            row = next(reader, None)
+            if row is None:
+                return
+            if row:
+                yield start, row
+
+    def csv_record(self, row: list) -> Record:
+        return self.record_from_row(dict(zip_longest(self.fieldnames, row[:len(self.fieldnames)])))
+
+    def bulk_load(self, path: str, chunk_size: int = 10000, workers: int = None):
+        """Imports a CSV or JSONL file, validating chunks in a process pool.
+
+        Returns the number of imported records and a list of (line, error) for rejected rows.
+        """
+        records = []
+        rejected = []
+        workers = workers or os.cpu_count() or 1
+        chunks = chunked(read_import_rows(path), chunk_size)
+        if workers == 1:
+            for valid, invalid in map(validate_rows, chunks):
+                records += valid
+                rejected += invalid
+        else:
+            with ProcessPoolExecutor(workers) as executor:
+                window = workers * 2
+                futures = [executor.submit(validate_rows, chunk) for chunk in islice(chunks, window)]
+                while futures:
+                    valid, invalid = futures.pop(0).result()
+                    records += valid
+                    rejected += invalid
+                    futures += [executor.submit(validate_rows, chunk) for chunk in islice(chunks, 1)]
+        self.merge(records)
+        return len(records), rejected
+
+    def merge(self, records: list[Record]):
+        self.next_version()
+        remembered = len(records) <= self.max_history
+        if not remembered:
+            self.history = []
+            self.history_floor = self.version
+        if self.storage is not None:
+            with self.lock.writing():
+                for record in records if remembered else ():
+                    previous = self.get(record.name.value)
+                    self.remember(record.name.value, previous.row() if previous else None)
+                if self.batch is not None:
+                    for record in records:
+                        record.book = self
+                        self.batch[record.name.value] = record
+                else:
+                    self.storage.put_many(records)
+                for record in records:
+                    self.index_name(record.name.value)
+            return
+        with self.lock.writing():
+            for record in records:
+                if remembered:
+                    previous = self.get(record.name.value)
+                    self.remember(record.name.value, previous.row() if previous else None)
+                self.offsets.pop(record.name.value, None)
+                self.data[record.name.value] = record
+                record.book = self
+                self.index_record(record)
+        if self.journal is not None and records:
+            self.request_compaction()
+
+    def materialize(self, name: str) -> Record:
+        with self.lock.writing():
+            if name in self.data:
+                return self.data[name]
+            offset = self.offsets.pop(name)
+            if self.snapshot is not None:
+                record = self.read_record(offset)
+            else:
+                with open(self.filename, 'rb') as fh:
+                    record = self.read_record(offset, fh)
+            self.data[name] = record
+            record.book = self
+            self.index_record(record)
+            return record
+
+    def materialize_all(self):
+        with self.lock.writing():
+            if not self.offsets:
+                return
+            if self.snapshot is not None:
+                for name, offset in list(self.offsets.items()):
+                    record = self.snapshot.record_at(offset)
+                    self.data[name] = record
+                    record.book = self
+                    self.index_record(record)
+                self.offsets = {}
+                return
+            names = {offset: name for name, offset in self.offsets.items()}
+            with open(self.filename, 'rb') as fh:
+                for offset, row in self.csv_rows(fh):
+                    name = names.get(offset)
+                    if name is None:
+                        continue
+                    record = self.csv_record(row)
+                    self.data[name] = record
+                    record.book = self
+                    self.index_record(record)
+            self.offsets = {}
+
+    def export_changes(self, path: str, since: int = None) -> tuple[int, int]:
+        """Writes the records added, changed or removed after version `since` of this book,
+        each with its state at `since` as the merge base. Without `since` every record is
+        written as added. Returns the number of rows and the version to export from next."""
+        with self.lock.reading():
+            version = self.version
+            if since is None:
+                bases = dict.fromkeys(self)
+            elif not self.history_floor <= since <= version:
+                raise Exception(
+                    f"Changes are kept from version {self.history_floor} to {version}, "
+                    "export without a version for a full sync"
+                )
+            else:
+                bases = {}
+                for _, name, before in self.history[bisect_right(self.history, since, key=itemgetter(0)):]:
+                    bases.setdefault(name, before)
+        written = 0
+        with open(path, 'w', encoding='UTF8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Name", "Status", "Phones", "Birthday", "Base Phones", "Base Birthday"])
+            for name, base in bases.items():
+                record = self.get(name)
+                current = record.row() if record is not None else None
+                if current == base:
+                    continue
+                status = "added" if base is None else "removed" if current is None else "changed"
+                _, phones, birthday = current or (name, (), "")
+                _, base_phones, base_birthday = base or (name, (), "")
+                writer.writerow([name, status, " ".join(phones), birthday, " ".join(base_phones), base_birthday])
+                written += 1
+        return written, version
+
+    @staticmethod
+    def merge_rows(base: tuple, local: tuple, theirs: tuple) -> tuple[tuple, bool]:
+        """Three-way merge of record rows, None standing for a missing record. Phones merge
+        as sets; a birthday both sides changed differently keeps the local value and is
+        reported as a conflict, as is a removal on one side against a change on the other."""
+        if local == theirs or theirs == base:
+            return local, False
+        if local == base:
+            return theirs, False
+        if local is None or theirs is None:
+            return local, True
+        base_phones = base[1] if base else ()
+        removed = set(base_phones) - set(theirs[1])
+        phones = [p for p in local[1] if p not in removed]
+        phones += [p for p in theirs[1] if p not in base_phones and p not in phones]
+        base_birthday = base[2] if base else ""
+        birthday, conflict = local[2], False
+        if local[2] == base_birthday:
+            birthday = theirs[2]
+        elif theirs[2] not in (base_birthday, local[2]):
+            conflict = True
+        return (local[0], tuple(phones), birthday), conflict
+
+    def import_changes(self, path: str) -> tuple[int, list[str]]:
+        """Applies a change set written by `export_changes`. Returns the number of records
+        changed here and the names whose conflicting edits kept the local value."""
+        applied = 0
+        conflicts = []
+        with open(path, encoding='UTF8', newline='') as file, self.transaction():
+            for row in csv.DictReader(file):
+                name = row["Name"]
+                theirs = None
+                if row["Status"] != "removed":
+                    theirs = Record.from_row((name, row["Phones"].split(), row["Birthday"])).row()
+                base = None
+                if row["Status"] != "added":
+                    base = Record.from_row((name, row["Base Phones"].split(), row["Base Birthday"])).row()
+                record = self.get(name)
+                local = record.row() if record is not None else None
+                merged, conflict = self.merge_rows(base, local, theirs)
+                if conflict:
+                    conflicts.append(name)
+                if merged == local:
+                    continue
+                if merged is None:
+                    self.remove_record(name)
+                else:
+                    self.add_record(Record.from_row(merged))
+                applied += 1
+        return applied, conflicts
+
+    def load(self):
+        if os.path.exists(self.filename):
+            if self.filename.endswith('.bin'):
+                self.load_snapshot()
+            else:
+                self.load_from_csv(lazy=True)
+        self.open_journal()
+        self.start_autosave()
+
+    def open_journal(self):
+        self.open_versions(self.filename + '.version')
+        replayed = 0
+        for filename in (self.journal_filename + '.old', self.journal_filename):
+            if os.path.exists(filename):
+                for name, record in Journal.replay(filename):
+                    if record is not None:
+                        self.add_record(record)
+                    elif name in self:
+                        self.remove_record(name)
+                    replayed += 1
+        self.journal = Journal(self.journal_filename)
+        self.journal.entries = replayed
+        self.history_floor = self.version
+        if os.path.exists(self.journal_filename + '.old'):
+            self.compact()
+
+    def compact(self):
+        """Folds the journal into a fresh snapshot on a background thread. Records that were
+        never loaded are copied from the current file as they are and stay unloaded."""
+        if self.compaction is not None:
+            self.compaction.join()
+        self.journal.close()
+        old_journal = self.journal_filename + '.old'
+        if os.path.exists(old_journal):
+            with open(self.journal_filename, 'rb') as source, open(old_journal, 'ab') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(self.journal_filename)
+        else:
+            os.replace(self.journal_filename, old_journal)
+        self.journal = Journal(self.journal_filename)
+        with self.lock.writing():
+            rows = self.rows_of(self.data.values())
+            unloaded = self.offsets.copy()
+
+        def fold():
+            new_filename = self.filename + '.new'
+            offsets = self.save(rows + self.unloaded_rows(unloaded), new_filename)
+            with self.lock.writing():
+                os.replace(new_filename, self.filename)
+                if isinstance(self.offsets, SnapshotOffsets):
+                    taken = {row[0] for row in rows} | (self.offsets.taken - unloaded.taken)
+                    self.snapshot.close()
+                    self.load_snapshot()
+                    self.offsets.taken = taken
+                else:
+                    self.offsets = {name: offsets[name] for name in self.offsets}
+                    self.fieldnames = ["Name", "Phones", "Birthday"]
+            os.remove(old_journal)
+
+        self.compaction = threading.Thread(target=fold)
+        self.compaction.start()
+
+    def close_journal(self):
+        self.stop_autosave()
+        if self.compaction is not None:
+            self.compaction.join()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def write_back(self):
+        """Folds every pending change into the snapshot and closes the book."""
+        if self.journal is not None:
+            self.stop_autosave()
+            if self.journal.entries:
+                self.compact()
+        self.close()
+
+    def close(self):
+        self.close_journal()
+        if self.snapshot is not None:
+            self.offsets = {}
+            self.snapshot.close()
+            self.snapshot = None
+        if self.storage is not None:
+            self.storage.close()
+            self.storage = None
+        if self.scanner is not None:
+            self.scanner.close()
+            self.scanner = None
+
+
+class AddressBookManager:
+    """Opens books by name from `directory` and keeps the most recently used ones resident
+    while their materialized records fit in `max_records`; evicted books are written back."""
+
+    def __init__(self, directory: str = ".", extension: str = ".csv", max_records: int = 100000,
+                 sqlite: bool = False):
+        self.directory = directory
+        self.extension = extension
+        self.max_records = max_records
+        self.sqlite = sqlite
+        self.books = OrderedDict()
+        self.lock = threading.Lock()
+
+    def filename(self, name: str) -> str:
+        return os.path.join(self.directory, name + self.extension)
+
+    def add(self, name: str, book: AddressBook):
+        with self.lock:
+            self.books[name] = book
+            self.books.move_to_end(name)
+
+    def open(self, name: str) -> AddressBook:
+        with self.lock:
+            book = self.books.get(name)
+            if book is None:
+                if not re.fullmatch(r"[\w-]+", name):
+                    raise Exception("A book name may only contain letters, digits, '_' and '-'")
+                if self.sqlite:
+                    book = AddressBook(os.path.join(self.directory, name + '.csv'))
+                    book.open_storage(SqliteStorage(self.filename(name)))
+                else:
+                    book = AddressBook(self.filename(name))
+                    book.load()
+                self.books[name] = book
+            self.books.move_to_end(name)
+            self.evict()
+            return book
+
+    def resident_records(self) -> int:
+        return sum(len(book.data) for book in self.books.values())
+
+    def evict(self):
+        while len(self.books) > 1 and self.resident_records() > self.max_records:
+            _, book = self.books.popitem(last=False)
+            book.write_back()
+
+    def close(self):
+        with self.lock:
+            while self.books:
+                _, book = self.books.popitem(last=False)
+                book.write_back()
+
+
+class Query:
+    """Conjunction of `field op value` filters, e.g. `name~an birthday<30d phones>1`.
+
+    name and phone take `~` (substring) or `=`; birthday compares the days until the next
+    birthday (`30d` or `30`) and phones the number of phones. The planner starts from the
+    filter whose index yields the fewest candidates and checks the rest on each record.
+    """
+    term = re.compile(r"(name|phones|phone|birthday)(~|<=|>=|<|>|=)(.+)")
+    comparisons = {"<": lt, "<=": le, "=": eq, ">=": ge, ">": gt}
+
+    def __init__(self, terms: list[str]):
+        if not terms:
+            raise Exception("Please enter filters, e.g. 'find name~an birthday<30d phones>1'")
+        self.predicates = [self.parse(term) for term in terms]
+
+    @classmethod
+    def parse(cls, term: str) -> tuple:
+        match = cls.term.fullmatch(term)
+        if match is None:
+            raise Exception(f"Unknown filter {term}, use name, phone, birthday or phones")
+        field, op, value = match.groups()
+        if field in ("name", "phone"):
+            if op not in ("~", "="):
+                raise Exception(f"Filter {term} should use '~' or '='")
+            if field == "phone":
+                value = Phone(value) if op == "=" else Phone.separators.sub("", value).lstrip("+")
+        elif op == "~":
+            raise Exception(f"Filter {term} should compare with <, <=, =, >= or >")
+        else:
+            value = int(value.removesuffix("d") if field == "birthday" else value)
+        return field, op, value
+
+    def matches(self, record: Record, table: list[int]) -> bool:
+        for field, op, value in self.predicates:
+            if field == "name":
+                found = value in record.name.value if op == "~" else record.name.value == value
+            elif field == "phone":
+                if op == "~":
+                    found = any(value in phone for phone in record.phones)
+                else:
+                    found = value.key in record.keys
+            elif field == "birthday":
+                birthday = record.birthday
+                found = birthday is not None and self.comparisons[op](
+                    table[BirthdayCalendar.key(birthday.value.month, birthday.value.day)], value
+                )
+            else:
+                found = self.comparisons[op](len(record.keys), value)
+            if not found:
+                return False
+        return True
+
+    @staticmethod
+    def birthday_days(predicate: tuple):
+        """How many days ahead a birthday predicate reaches in the calendar, None if it can't use it."""
+        field, op, value = predicate
+        if field == "birthday" and op in ("<", "<=", "="):
+            return value - 1 if op == "<" else value
+        return None
+
+    @classmethod
+    def estimate(cls, book: AddressBook, predicate: tuple, today: date):
+        """Upper bound on the names `candidates` returns, read from posting-list and bucket
+        sizes without building them; None without an index."""
+        field, op, value = predicate
+        if field in ("name", "phone") and op == "~":
+            if book.storage is not None:
+                return book.storage.count_search(value)
+            with book.lock.reading():
+                return book.index.estimate(value)
+        if field == "name":
+            return 1
+        if field == "phone":
+            if book.storage is not None:
+                return book.storage.count_phone_owners(value.value)
+            with book.lock.reading():
+                return len(book.phone_index.owners(value.key))
+        days = cls.birthday_days(predicate)
+        if days is None:
+            return None
+        if days < 0:
+            return 0
+        if book.storage is not None:
+            return book.storage.count_upcoming(today, days)
+        with book.lock.reading():
+            return book.calendar.count(today, days)
+
+    @classmethod
+    def candidates(cls, book: AddressBook, predicate: tuple, today: date):
+        """Names that may satisfy `predicate` according to an index, None without one."""
+        field, op, value = predicate
+        if field in ("name", "phone") and op == "~":
+            if book.storage is not None:
+                return book.storage.search(value)
+            with book.lock.reading():
+                return list(book.index.candidates(value))
+        if field == "name":
+            return [value] if value in book else []
+        if field == "phone":
+            if book.storage is not None:
+                return book.storage.phone_owners(value.value)
+            with book.lock.reading():
+                return list(book.phone_index.owners(value.key))
+        days = cls.birthday_days(predicate)
+        if days is None:
+            return None
+        if days < 0:
+            return []
+        if book.storage is not None:
+            return list({name for _, name in book.storage.upcoming(today, days)})
+        with book.lock.reading():
+            return list({name for _, name in book.calendar.upcoming(today, days)})
+
+    def plan(self, book: AddressBook, today: date):
+        """The indexed predicate with the fewest estimated candidates and its candidate names,
+        or None; only the chosen predicate's candidates are built."""
+        best = None
+        for predicate in self.predicates:
+            size = self.estimate(book, predicate, today)
+            if size is not None and (best is None or size < best[0]):
+                best = size, predicate
+        if best is None:
+            return None
+        return best[1], self.candidates(book, best[1], today)
+
+    def run(self, book: AddressBook, today: date = None):
+        today = today or date.today()
+        if book.storage is None:
+            book.materialize_all()
+        table = BirthdayCalendar.distance_table(today)
+        plan = self.plan(book, today)
+        if plan is not None:
+            records = (book.get(name) for name in sorted(plan[1]))
+        elif book.storage is not None:
+            records = (book.get(name) for name in book.storage.names())
+        else:
+            with book.lock.reading():
+                records = list(book.data.values())
+        for record in records:
+            if record is not None and self.matches(record, table):
+                yield record
+
+
+def read_import_rows(path: str):
+    with open(path, newline='', encoding='UTF8') as fh:
+        if path.endswith('.jsonl'):
+            for line_no, line in enumerate(fh, 1):
+                if line.strip():
+                    yield line_no, line
+        else:
             reader = csv.DictReader(fh)
             for row in reader:
-                name = row["Name"]
-                birthday = row["Birthday"]
-                phones = [Phone(p) for p in row["Phones"][1:-1].split(", ")]
-                self.data[name] = Record(
-                    Name(name),
-                    None,
-                    Birthday(birthday) if birthday else None
-                ).add_phones(phones)
+                yield reader.line_num, row
 
 
+def validate_rows(rows: list) -> tuple[list[Record], list[tuple[int, str]]]:
+    records = []
+    rejected = []
+    for line_no, row in rows:
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+                row = {"Name": row["name"], "Phones": row.get("phones", []), "Birthday": row.get("birthday")}
+            records.append(AddressBook.record_from_row(row))
+        except KeyError as e:
+            rejected.append((line_no, f"Missing field {e}"))
+        except Exception as e:
+            rejected.append((line_no, str(e)))
+    return records, rejected
 
 
 def input_error(func):
+    name = func.__name__
+
+    @wraps(func)
     def wrapper(*args):
+        started = time.perf_counter()
         try:
-            return func(*args)
+            result = func(*args)
         except IndexError:
+            stats.record(name, time.perf_counter() - started, error=True)
             return "Sorry, reading from invalid index"
         except Exception as e:
+            stats.record(name, time.perf_counter() - started, error=True)
             return str(e)
+        if isinstance(result, str):
+            stats.record(name, time.perf_counter() - started, output=len(result))
+            return result
+        return stats.stream(name, started, result)
+
+    return wrapper
+
+
+def cached(func):
+    """Serves repeated calls from `results` until the next change to the book they read."""
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args):
+        book = contacts
+        key = (id(book), name, args, date.today())
+        version = book.version
+        text = results.get(key, version)
+        if text is not None:
+            return text
+        result = func(*args)
+        if isinstance(result, str):
+            results.put(key, version, result)
+            return result
+        return results.capture(key, version, result)
 
     return wrapper
 
 
 contacts = AddressBook()
+books = AddressBookManager()
 
 
 @input_error
@@ -220,8 +2406,9 @@ def remove_phone(*args):
     name = args[0]
     phone_number = args[1]
     if name in contacts.keys():
-        if Phone(phone_number) in contacts[name].phones:
-            contacts[name].remove_phone(Phone(phone_number))
+        removable_phone = Phone(phone_number)
+        if contacts.has_phone(name, removable_phone):
+            contacts[name].remove_phone(removable_phone)
             return f"This is REMOVE phone {phone_number} from name {name}"
         else:
             return f"This {phone_number} is not defined"
@@ -235,8 +2422,9 @@ def change_phone(*args):
     phone_number = args[1]
     new_phone_number = args[2]
     if name in contacts.keys():
-        if Phone(phone_number) in contacts[name].phones:
-            contacts[name].change_phone(Phone(phone_number), Phone(new_phone_number))
+        changeable_phone = Phone(phone_number)
+        if contacts.has_phone(name, changeable_phone):
+            contacts[name].change_phone(changeable_phone, Phone(new_phone_number))
             return f"This is CHANGE phone {phone_number} to new number {new_phone_number} for name {name}"
         else:
             return f"This phone number {phone_number} is not defined"
@@ -248,39 +2436,77 @@ def hello(*args):
     return "How can I help you?"
 
 
+def show_stats(*args):
+    return stats.report() + "\n" + results.report()
+
+
 @input_error
 def change(*args):
     name = args[0]
     phone_number = args[1]
-    if name in contacts.keys():
-        contacts.change_record(
-            Record(
-                Name(name),
-                [Phone(phone_number)]
+    with contacts.lock.writing():
+        if name in contacts.keys():
+            contacts.change_record(
+                Record(
+                    Name(name),
+                    Phone(phone_number),
+                    contacts[name].birthday
+                )
             )
-        )
-        return f"This is CHANGE, phone {phone_number} for name {name}"
-    else:
-        raise Exception("Name is not found in contacts")
+            return f"This is CHANGE, phone {phone_number} for name {name}"
+        else:
+            raise Exception("Name is not found in contacts")
 
 
 @input_error
+@cached
 def phone(*args):
     name = args[0]
     if name in contacts.keys():
-        return f"This is phone {contacts.get(name).phones} for name {name}"
+        return f"This is phone [{', '.join(contacts.get(name).phones)}] for name {name}"
 
     else:
         raise Exception("Name is not found in contacts")
 
 
 @input_error
+@cached
+def fuzzy(*args):
+    term = args[0]
+    max_distance = int(args[1]) if len(args) > 1 else 2
+    found = contacts.fuzzy_search(term, max_distance)
+    if not found:
+        raise Exception(f"No names within distance {max_distance} of {term}")
+    return "Did you mean: " + ", ".join(f"{name} ({distance})" for distance, name in found)
+
+
+@input_error
+@cached
+def who(*args):
+    phone_number = Phone(args[0])
+    owners = contacts.phone_owners(phone_number)
+    if not owners:
+        raise Exception(f"This phone number {phone_number} is not found in contacts")
+    return f"The phone {phone_number} belongs to {', '.join(r.name.value for r in owners)}"
+
+
+@input_error
+@cached
+def duplicates(*args):
+    shared = contacts.duplicate_phones()
+    if not shared:
+        return "There are no phone numbers shared by several contacts"
+    return "\n".join(f"{phone}: {', '.join(names)}" for phone, names in shared.items())
+
+
+@input_error
+@cached
 def days_to_birthday(*args):
     name = args[0]
     if name in contacts.keys():
         record = contacts[name]
         if record.birthday:
-            days = record.birthday.days_diff(datetime.now())
+            days = record.birthday.days_until(date.today())
 
             return f"The {days} days left to birthday of contact {name}"
 
@@ -291,44 +2517,160 @@ def days_to_birthday(*args):
 
 
 @input_error
-def search(*args):
-    term = args[0]
+def import_file(*args):
+    path = args[0]
+    imported, rejected = contacts.bulk_load(path)
+    message = f"Imported {imported} contacts from {path}"
+    if rejected:
+        message += f", rejected {len(rejected)} rows:"
+        for line_no, error in rejected[:10]:
+            message += f"\n  line {line_no}: {error}"
+        if len(rejected) > 10:
+            message += f"\n  ... and {len(rejected) - 10} more"
+    return message
+
+
+@input_error
+def remove(*args):
+    name = args[0]
+    if name not in contacts:
+        raise Exception(f"This Name {name} is not found in contacts")
+    contacts.remove_record(name)
+    return f"This is REMOVE, name {name}"
+
+
+@input_error
+def export_changes(*args):
+    path = args[0]
+    since = int(args[1]) if len(args) > 1 else None
+    written, version = contacts.export_changes(path, since)
+    return f"Exported {written} changes to {path}, next export from version {version}"
+
+
+@input_error
+def sync(*args):
+    path = args[0]
+    applied, conflicts = contacts.import_changes(path)
+    message = f"Applied {applied} changes from {path}"
+    if conflicts:
+        message += f", kept local values for {len(conflicts)} conflicts: {', '.join(conflicts)}"
+    return message
+
+
+@input_error
+@cached
+def birthdays(*args):
+    days = int(args[0])
     pattern = '{0:10} {1:10} {2:10}\n'
-    table = pattern.format("Name", "Phones", "Birthday")
-    for record in contacts.search(term):
-        table += pattern.format(
+    rows = [pattern.format("Name", "Birthday", "Days")]
+    for offset, record in contacts.upcoming_birthdays(days):
+        rows.append(pattern.format(
             record.name.value,
-            ", ".join(map(repr, record.phones)),
-            str(record.birthday.value) if record.birthday else "None"
-        )
-    return table
+            str(record.birthday),
+            str(offset)
+        ))
+    return "".join(rows)
 
 
-@input_error
-def show_all(*args):
+def chunked(records, page_size: int):
+    records = iter(records)
+    while page := list(islice(records, page_size)):
+        yield page
+
+
+def render_pages(pages):
     pattern = '{0:10} {1:10} {2:10}\n'
-    table = pattern.format("Name", "Phones", "Birthday")
-    for page in contacts.iterator(5):
-        for record in page:
-            table += pattern.format(
+    yield pattern.format("Name", "Phones", "Birthday")
+    for page in pages:
+        yield "".join(
+            pattern.format(
                 record.name.value,
-                ", ".join(map(repr, record.phones)),
+                ", ".join(record.phones),
                 str(record.birthday.value) if record.birthday else "None"
             )
-    return table
+            for record in page
+        )
+
+
+class Session:
+    """What one client keeps between commands: the page cursor of `show all`."""
+    __slots__ = ("cursor",)
+
+    def __init__(self):
+        self.cursor = None
+
+
+current_session = ContextVar("current_session", default=Session())
+
+
+@input_error
+@cached
+def search(*args):
+    term = args[0]
+    return render_pages(chunked(contacts.search(term), 5))
+
+
+@input_error
+@cached
+def find(*args):
+    query = Query(list(args))
+    return render_pages(chunked(query.run(contacts), 5))
+
+
+@input_error
+@cached
+def scan(*args):
+    pattern = args[0]
+    re.compile(pattern)
+    return render_pages(chunked(contacts.scan(pattern), 5))
+
+
+@cached
+def show_contacts(*args):
+    if args:
+        return render_pages(chunked(contacts.by_upcoming_birthday(), 5))
+    return render_pages(contacts.iterator(5))
+
+
+@input_error
+def show_all(*args):
+    if not args or args[0] == "birthday":
+        return show_contacts(*args)
+    page_number = int(args[0])
+    page_size = int(args[1]) if len(args) > 1 else 5
+    if page_number < 1 or page_size < 1:
+        raise Exception("Page and size should be positive numbers")
+    session = current_session.get()
+    session.cursor = contacts.iterator(page_size)
+    page = next(islice(session.cursor, page_number - 1, None), [])
+    return "".join(render_pages([page]))
+
+
+@input_error
+def next_page(*args):
+    cursor = current_session.get().cursor
+    page = next(cursor, []) if cursor else []
+    if not page:
+        raise Exception("There are no more pages, use 'show all <page> <size>'")
+    return "".join(render_pages([page]))
+
+
+@input_error
+def use(*args):
+    global contacts
+    name = args[0]
+    contacts = books.open(name)
+    current_session.get().cursor = None
+    results.clear()
+    return f"Using address book {name} with {len(contacts)} contacts"
 
 
 @input_error
 def close(*args):
-    answer = input(">>> Would you like to save changes (Y/N)? ")
-    if answer == "N":
-        exit(0)
-    elif answer == "Y":
-        contacts.write_to_csv()
-        print("The changes has been saved to file addressbook.csv ")
-        exit(0)
-    else:
-        raise Exception("Please enter Y or N")
+    filename = contacts.storage.filename if contacts.storage else contacts.filename
+    books.close()
+    print(f"The changes has been saved to file {filename}")
+    exit(0)
 
 
 COMMANDS = {
@@ -337,29 +2679,161 @@ COMMANDS = {
     "phone change": change_phone,
     "phone remove": remove_phone,
     "days to birthday": days_to_birthday,
+    "birthdays": birthdays,
     "hello": hello,
+    "stats": show_stats,
     "change": change,
     "phone": phone,
     "show all": show_all,
+    "next page": next_page,
     "search": search,
+    "find": find,
+    "fuzzy": fuzzy,
+    "scan": scan,
+    "who": who,
+    "duplicates": duplicates,
+    "import": import_file,
+    "export": export_changes,
+    "sync": sync,
+    "remove": remove,
+    "use": use,
     "close": close,
     "good bye": close,
     "exit": close,
     }
 
 
+def build_command_trie(commands: dict) -> dict:
+    trie = {}
+    for key_word, command in commands.items():
+        node = trie
+        for token in key_word.split():
+            node = node.setdefault(token, {})
+        node[None] = command
+    return trie
+
+
+COMMAND_TRIE = build_command_trie(COMMANDS)
+
+
+def tokenize(user_input: str) -> list[str]:
+    if '"' not in user_input and "'" not in user_input:
+        return user_input.split()
+    tokens = []
+    token = []
+    quote = None
+    started = False
+    for char in user_input:
+        if quote:
+            if char == quote:
+                quote = None
+            else:
+                token.append(char)
+        elif char in "'\"" and not started:
+            quote = char
+            started = True
+        elif char.isspace():
+            if started:
+                tokens.append("".join(token))
+                token = []
+                started = False
+        else:
+            token.append(char)
+            started = True
+    if started:
+        tokens.append("".join(token))
+    return tokens
+
+
+@timed
 def command_parser(user_input: str):
-    for key_word, command in COMMANDS.items():
-        if user_input.lower().startswith(key_word):
-            return command, user_input.replace(key_word, "").strip().split(" ")
-    return None, None
+    tokens = tokenize(user_input)
+    node = COMMAND_TRIE
+    command, args = None, None
+    for i, token in enumerate(tokens):
+        node = node.get(token.lower())
+        if node is None:
+            break
+        if None in node:
+            command, args = node[None], tokens[i + 1:]
+    return command, args
+
+
+MUTATIONS = {add, add_phone, remove_phone, change_phone, change, import_file, remove, sync}
+
+
+def run_batch(lines, out=sys.stdout, buffer_size: int = 1 << 16) -> tuple[int, float]:
+    """Executes one command per line, wrapping each run of consecutive mutations in a
+    single transaction. Blank lines, '#' comments and close commands are skipped."""
+    started = time.perf_counter()
+    executed = 0
+    pending = []
+    size = 0
+    parsed = (command_parser(line.strip()) for line in lines if line.strip() and not line.lstrip().startswith('#'))
+    for mutating, group in groupby(parsed, key=lambda parsed: parsed[0] in MUTATIONS):
+        with contacts.transaction() if mutating else nullcontext():
+            for command, data in group:
+                if command is close:
+                    continue
+                result = command(*data) if command else "Sorry, unknown command"
+                text = (result if isinstance(result, str) else "".join(result)) + "\n"
+                pending.append(text)
+                size += len(text)
+                executed += 1
+                if size >= buffer_size:
+                    out.write("".join(pending))
+                    pending = []
+                    size = 0
+    out.write("".join(pending))
+    out.flush()
+    return executed, time.perf_counter() - started
+
+
+def print_result(result):
+    if isinstance(result, str):
+        print(result)
+        return
+    for chunk in result:
+        print(chunk, end="", flush=True)
+    print()
+
+
+def open_contacts(sqlite: str = None, filename: str = None, max_records: int = 100000):
+    """Opens the starting book; `use <book>` opens its siblings in the same directory."""
+    global contacts, books
+    results.clear()
+    if filename:
+        contacts = AddressBook(filename)
+    path = sqlite or contacts.filename
+    stem, extension = os.path.splitext(path)
+    books = AddressBookManager(os.path.dirname(path) or ".", extension, max_records, bool(sqlite))
+    if sqlite:
+        contacts.open_storage(SqliteStorage(sqlite))
+    else:
+        contacts.load()
+    books.add(os.path.basename(stem), contacts)
 
 
 def main():
-    file_exists = os.path.exists('addressbook.csv')
-    if file_exists:
-        contacts.load_from_csv()
-
+    parser = argparse.ArgumentParser(description="Address book assistant bot")
+    parser.add_argument("--file", metavar="PATH", help="address book snapshot, .csv or binary .bin")
+    parser.add_argument("--sqlite", metavar="PATH", help="keep the address book in a SQLite database")
+    parser.add_argument("--stats-file", metavar="PATH", help="periodically dump command statistics as JSON")
+    parser.add_argument("--stats-interval", type=float, default=60, help="seconds between statistics dumps")
+    parser.add_argument("--batch", metavar="PATH", help="run the commands in PATH ('-' for stdin) and exit")
+    parser.add_argument("--max-records", type=int, default=100000,
+                        help="records kept in memory across the books opened with 'use'")
+    args = parser.parse_args()
+    if args.stats_file:
+        stats.start_dump(args.stats_file, args.stats_interval)
+    open_contacts(args.sqlite, args.file, args.max_records)
+
+    if args.batch:
+        with open(args.batch, encoding='UTF8') if args.batch != '-' else nullcontext(sys.stdin) as fh:
+            executed, elapsed = run_batch(fh)
+        books.close()
+        print(f"{executed} commands in {elapsed:.3f}s ({executed / max(elapsed, 1e-9):.0f} commands/s)", file=sys.stderr)
+        return
 
     while True:
         user_input = input(">>> ")
@@ -368,7 +2842,7 @@ def main():
         if not command:
             print("Sorry, unknown command")
         else:
-            print(command(*data))
+            print_result(command(*data))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+from itertools import islice
+
+import bot_helper_with_search as bot
+
+SESSION_END_COMMANDS = {bot.close}
+# Switching the book rebinds the module-wide `contacts` that every session shares,
+# and the file commands would let any client read or write paths on the server.
+LOCAL_COMMANDS = {bot.use, bot.import_file, bot.export_changes, bot.sync}
+
+
+class BotServer:
+    """Line protocol server: one command per line, each answer ends with an empty line.
+
+    Commands run on worker threads, so a slow one does not hold up other sessions;
+    the AddressBook read/write lock keeps them consistent.
+    """
+    chunks_per_step = 64
+
+    def __init__(self):
+        self.sessions = 0
+
+    async def execute(self, user_input: str):
+        command, data = bot.command_parser(user_input)
+        if not command:
+            return "Sorry, unknown command"
+        if command in LOCAL_COMMANDS:
+            return "Sorry, this command is only available in the local assistant"
+        return await asyncio.to_thread(command, *data)
+
+    async def respond(self, writer: asyncio.StreamWriter, result):
+        chunks = iter([str(result)] if isinstance(result, str) else result)
+        pending = ""
+        while step := await asyncio.to_thread(lambda: list(islice(chunks, self.chunks_per_step))):
+            text = pending + "".join(step)
+            body = text.rstrip("\n")
+            pending = text[len(body):]
+            writer.write(body.encode('UTF8'))
+            await writer.drain()
+        writer.write(b"\n\n")
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        bot.current_session.set(bot.Session())
+        self.sessions += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                user_input = line.decode('UTF8').strip()
+                command, _ = bot.command_parser(user_input)
+                if command in SESSION_END_COMMANDS:
+                    writer.write(b"Good Bye!\n\n")
+                    await writer.drain()
+                    break
+                await self.respond(writer, await self.execute(user_input))
+        finally:
+            self.sessions -= 1
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8000, path: str = None):
+        if path:
+            return await asyncio.start_unix_server(self.handle, path=path)
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, user_input: str) -> str:
+    writer.write(user_input.encode('UTF8') + b"\n")
+    await writer.drain()
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line or line == b"\n":
+            return "\n".join(lines)
+        lines.append(line.decode('UTF8').rstrip("\n"))
+
+
+async def serve(host: str, port: int, path: str = None):
+    server = await BotServer().start(host, port, path)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the address book over a line protocol")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--file", metavar="PATH", help="address book snapshot, .csv or binary .bin")
+    parser.add_argument("--sqlite", metavar="PATH", help="keep the address book in a SQLite database")
+    args = parser.parse_args()
+
+    bot.open_contacts(args.sqlite, args.file)
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix))
+    finally:
+        bot.books.close()
+
+
+if __name__ == '__main__':
+    main()
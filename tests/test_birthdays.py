@@ -0,0 +1,34 @@
+from datetime import date
+
+import pytest
+
+import bot_helper_with_search as bot
+
+
+def make_book(tmp_path, birthdays):
+    book = bot.AddressBook(str(tmp_path / "book.csv"))
+    for name, birthday in birthdays.items():
+        book.add_record(bot.Record(bot.Name(name), bot.Phone("1"), bot.Birthday(birthday)))
+    return book
+
+
+@pytest.mark.parametrize("storage", [False, True])
+def test_year_long_window_lists_each_contact_once(tmp_path, storage):
+    book = make_book(tmp_path, {"x": "1990-10-18", "leap": "2000-02-29"})
+    if storage:
+        book.open_storage(bot.SqliteStorage(str(tmp_path / "book.db")))
+    upcoming = [(offset, record.name.value) for offset, record in book.upcoming_birthdays(366, date(2026, 10, 18))]
+    assert upcoming == [(0, "x"), (133, "leap")]
+
+
+@pytest.mark.parametrize("today, birthday, days", [
+    (date(2026, 10, 18), "1990-10-18", 0),
+    (date(2026, 10, 18), "1990-10-17", 364),
+    (date(2027, 2, 1), "2000-02-29", 27),
+    (date(2028, 2, 1), "2000-02-29", 28),
+])
+def test_days_until_matches_calendar(today, birthday, days):
+    value = bot.Birthday(birthday)
+    table = bot.BirthdayCalendar.distance_table(today)
+    assert value.days_until(today) == days
+    assert table[bot.BirthdayCalendar.key(value.value.month, value.value.day)] == days
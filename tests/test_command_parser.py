@@ -0,0 +1,34 @@
+import pytest
+
+import bot_helper
+import bot_helper_with_birthday
+import bot_helper_with_class
+import bot_helper_with_search
+
+VARIANTS = [bot_helper, bot_helper_with_class, bot_helper_with_birthday, bot_helper_with_search]
+
+
+@pytest.mark.parametrize("module", VARIANTS)
+@pytest.mark.parametrize("line, tokens", [
+    ("add bob 123", ["add", "bob", "123"]),
+    ("add O'Brien 123", ["add", "O'Brien", "123"]),
+    ("add Мар'яна 380501234567", ["add", "Мар'яна", "380501234567"]),
+    ('add "Anna Maria" 123', ["add", "Anna Maria", "123"]),
+    ("add 'Anna Maria' 123", ["add", "Anna Maria", "123"]),
+    ('add "D\'Artagnan" 123', ["add", "D'Artagnan", "123"]),
+])
+def test_tokenize(module, line, tokens):
+    assert module.tokenize(line) == tokens
+
+
+@pytest.mark.parametrize("module", VARIANTS)
+def test_apostrophe_name_reaches_add(module):
+    command, args = module.command_parser("add O'Brien 123")
+    assert command is module.add
+    assert args == ["O'Brien", "123"]
+
+
+def test_longest_keyword_wins():
+    command, args = bot_helper_with_search.command_parser("phone remove bob 123")
+    assert command is bot_helper_with_search.remove_phone
+    assert args == ["bob", "123"]
@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+import bot_helper_with_search as bot
+
+ROWS = [(f"name{i}", (f"{1000 + i}",), "1990-01-02" if i % 2 else "") for i in range(50)]
+
+
+def open_book(path):
+    book = bot.AddressBook(path, compact_after=5)
+    if path.endswith('.bin'):
+        book.load_snapshot()
+    else:
+        book.load_from_csv(lazy=True)
+    book.open_journal()
+    return book
+
+
+@pytest.fixture(params=["book.csv", "book.bin"])
+def path(request, tmp_path):
+    path = str(tmp_path / request.param)
+    book = bot.AddressBook(path)
+    book.merge([bot.Record.from_row(row) for row in ROWS])
+    book.save()
+    return path
+
+
+def test_compaction_keeps_unloaded_records_unloaded(path):
+    book = open_book(path)
+    book.add_record(bot.Record(bot.Name("new"), bot.Phone("1")))
+    book.remove_record("name3")
+    book.compact()
+    book.compaction.join()
+    assert sorted(book.data) == ["new"]
+    assert len(book) == len(ROWS)
+    assert book["name7"].row() == ROWS[7]
+    book.close()
+    reopened = open_book(path)
+    assert "name3" not in reopened and reopened["new"].phones == ["1"]
+    assert sorted(record.row() for record in reopened.values()) == sorted(
+        [row for row in ROWS if row[0] != "name3"] + [("new", ("1",), "")])
+    reopened.close()
+
+
+def test_compaction_waits_for_a_share_of_the_book(path):
+    book = open_book(path)
+    book.compact_share = 2
+    for i in range(len(ROWS) // 2):
+        assert book.compaction is None
+        book.add_record(bot.Record(bot.Name(f"name{i}"), bot.Phone("1")))
+    assert book.compaction is not None
+    book.close()
+
+
+def test_startup_replays_journal_without_compacting(path):
+    book = open_book(path)
+    book.add_record(bot.Record(bot.Name("new"), bot.Phone("1")))
+    book.close()
+    reopened = open_book(path)
+    assert reopened.compaction is None
+    assert sorted(reopened.data) == ["new"]
+    assert reopened.journal.entries == 1
+    reopened.close()
+
+
+def test_unfinished_fold_is_kept_until_the_next_one_finishes(path):
+    book = open_book(path)
+    book.add_record(bot.Record(bot.Name("first"), bot.Phone("1")))
+    book.close()
+    os.replace(book.journal_filename, book.journal_filename + '.old')
+    book = open_book(path)
+    book.compaction.join()
+    book.add_record(bot.Record(bot.Name("second"), bot.Phone("2")))
+    book.close()
+    reopened = open_book(path)
+    assert "first" in reopened and "second" in reopened
+    assert not os.path.exists(reopened.journal_filename + '.old')
+    reopened.close()
+
+
+def test_replay_cuts_off_a_torn_last_row(path):
+    book = open_book(path)
+    book.add_record(bot.Record(bot.Name("new"), bot.Phone("1")))
+    book.remove_record("name3")
+    book.close()
+    with open(book.journal_filename, 'ab') as journal:
+        journal.write(b'torn,"12')
+    reopened = open_book(path)
+    assert "new" in reopened and "name3" not in reopened and "torn" not in reopened
+    assert reopened.journal.entries == 2
+    reopened.close()
+    with open(book.journal_filename, 'rb') as journal:
+        assert b"torn" not in journal.read()
@@ -0,0 +1,49 @@
+import bot_helper_with_search as bot
+
+CSV = (
+    'Name,Phones,Birthday\r\n'
+    'Ann,[111],1990-01-02\r\n'
+    '\r\n'
+    '"Multi\nLine",[222],\r\n'
+    "Мар'яна,\"[333, 444]\",\r\n"
+    '\r\n'
+)
+
+
+def write_book(tmp_path):
+    path = tmp_path / "book.csv"
+    path.write_bytes(CSV.encode('UTF8'))
+    book = bot.AddressBook(str(path))
+    book.load_from_csv(lazy=True)
+    return book
+
+
+ROWS = [
+    ("Ann", ("111",), "1990-01-02"),
+    ("Multi\nLine", ("222",), ""),
+    ("Мар'яна", ("333", "444"), ""),
+]
+
+
+def test_lazy_load_materializes_each_row(tmp_path):
+    book = write_book(tmp_path)
+    assert sorted(book.offsets) == sorted(row[0] for row in ROWS)
+    assert [book[name].row() for name, _, _ in ROWS] == ROWS
+
+
+def test_lazy_load_materialize_all(tmp_path):
+    book = write_book(tmp_path)
+    book.materialize_all()
+    assert not book.offsets
+    assert sorted(record.row() for record in book.data.values()) == sorted(ROWS)
+
+
+def test_iterator_pages_unloaded_records(tmp_path):
+    path = str(tmp_path / "book.bin")
+    bot.BinarySnapshot.write(path, [(name, phones, None) for name, phones, _ in ROWS])
+    book = bot.AddressBook(path)
+    book.load_snapshot()
+    pages = list(book.iterator(2))
+    assert sorted(record.name.value for page in pages for record in page) == sorted(row[0] for row in ROWS)
+    assert not book.data
+    book.close()
@@ -0,0 +1,52 @@
+from datetime import date
+
+import pytest
+
+import bot_helper_with_search as bot
+
+TODAY = date(2026, 10, 18)
+CONTACTS = [
+    ("Anna", ["0501112233"], "1990-10-20"),
+    ("Andrii", ["0671112233", "0501234567"], "1985-12-01"),
+    ("Bohdan", ["0931112233"], None),
+    ("Oksana", ["0671234567"], "2000-10-18"),
+]
+
+
+@pytest.fixture(params=[False, True], ids=["memory", "sqlite"])
+def book(request, tmp_path):
+    book = bot.AddressBook(str(tmp_path / "book.csv"))
+    if request.param:
+        book.open_storage(bot.SqliteStorage(str(tmp_path / "book.db")))
+    for name, phones, birthday in CONTACTS:
+        record = bot.Record(bot.Name(name), bot.Phone(phones[0]), bot.Birthday(birthday) if birthday else None)
+        book.add_record(record)
+        for phone in phones[1:]:
+            book[name].add_phone(bot.Phone(phone))
+    return book
+
+
+@pytest.mark.parametrize("query, names", [
+    ("name~an birthday<365d", ["Oksana"]),
+    ("name~An phones>1", ["Andrii"]),
+    ("phone~067 birthday<=30", ["Oksana"]),
+    ("birthday=0", ["Oksana"]),
+    ("phone=0501112233", ["Anna"]),
+    ("name=Bohdan phones=1", ["Bohdan"]),
+])
+def test_find(book, query, names):
+    assert sorted(record.name.value for record in bot.Query(query.split()).run(book, TODAY)) == names
+
+
+def test_plan_builds_only_the_chosen_candidates(book, monkeypatch):
+    built = []
+    candidates = bot.Query.candidates.__func__
+
+    def record(cls, book, predicate, today):
+        built.append(predicate[0])
+        return candidates(cls, book, predicate, today)
+
+    monkeypatch.setattr(bot.Query, "candidates", classmethod(record))
+    predicate, names = bot.Query("name~an birthday=0".split()).plan(book, TODAY)
+    assert built == ["birthday"]
+    assert predicate[0] == "birthday" and names == ["Oksana"]
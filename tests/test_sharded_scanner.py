@@ -0,0 +1,29 @@
+import bot_helper_with_search as bot
+
+
+def records(*names):
+    return [bot.Record(bot.Name(name), bot.Phone("0501234567")) for name in names]
+
+
+def test_rebuild_drops_cached_shards_of_previous_build():
+    scanner = bot.ShardedScanner(shards=1)
+    scanner.build(records("Ann", "Bob"), 1)
+    assert list(scanner.scan("Ann", regex=False)) == ["Ann"]
+    first = scanner.directory
+    scanner.build(records("Ann", "Anton"), 2)
+    assert list(scanner.scan("An", regex=False)) == ["Ann", "Anton"]
+    assert list(bot.open_shards) == [scanner.directory] != [first]
+    scanner.close()
+    assert not bot.open_shards
+
+
+def test_worker_cache_follows_build_directory(tmp_path):
+    for build in ("first", "second"):
+        directory = tmp_path / build
+        directory.mkdir()
+        for number in range(3):
+            (directory / f"shard{number}").write_bytes(f"{build}{number}\t1\n".encode('UTF8'))
+            assert bot.scan_shard(str(directory / f"shard{number}"), build, False) == [f"{build}{number}"]
+        assert list(bot.open_shards) == [str(directory)]
+        assert len(bot.open_shards[str(directory)]) == 3
+    bot.open_shards.clear()
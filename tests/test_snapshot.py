@@ -0,0 +1,38 @@
+from datetime import date
+
+import bot_helper_with_search as bot
+
+ROWS = [
+    ("Ann", ["0501234567", "380671112233"], date(1990, 1, 2)),
+    ("Мар'яна", ["123"], None),
+    ("Empty", [], date(2000, 2, 29)),
+]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "book.bin")
+    bot.BinarySnapshot.write(path, ROWS)
+    snapshot = bot.BinarySnapshot(path)
+    assert snapshot.count == len(ROWS)
+    assert [name for name, _ in snapshot.entries()] == [row[0] for row in ROWS]
+    for name, phones, birthday in ROWS:
+        record = snapshot.record_at(snapshot.lookup(name))
+        assert record.phones == phones
+        assert (record.birthday.value if record.birthday else None) == birthday
+    assert snapshot.lookup("Bob") is None
+    snapshot.close()
+
+
+def test_snapshot_copies_raw_records(tmp_path):
+    source_path = str(tmp_path / "source.bin")
+    bot.BinarySnapshot.write(source_path, ROWS)
+    source = bot.BinarySnapshot(source_path)
+    raw = [(name, source.map[offset:source.skip(offset)]) for name, offset in source.entries()]
+    path = str(tmp_path / "book.bin")
+    bot.BinarySnapshot.write(path, raw[:1] + [("Bob", ["7"], None)] + raw[1:])
+    snapshot = bot.BinarySnapshot(path)
+    assert snapshot.record_at(snapshot.lookup("Мар'яна")).phones == ["123"]
+    assert snapshot.record_at(snapshot.lookup("Bob")).phones == ["7"]
+    assert snapshot.count == len(ROWS) + 1
+    snapshot.close()
+    source.close()
@@ -0,0 +1,24 @@
+import bot_helper_with_search as bot
+
+
+def open_book(tmp_path):
+    book = bot.AddressBook(str(tmp_path / "book.csv"))
+    book.open_storage(bot.SqliteStorage(str(tmp_path / "book.db")))
+    return book
+
+
+def test_merge_inside_transaction_wins_over_earlier_batch(tmp_path):
+    book = open_book(tmp_path)
+    with book.transaction():
+        book.add_record(bot.Record(bot.Name("bob"), bot.Phone("1")))
+        book.merge([bot.Record(bot.Name("bob"), bot.Phone("2"))])
+    assert book["bob"].phones == ["2"]
+
+
+def test_pending_removal_hides_record(tmp_path):
+    book = open_book(tmp_path)
+    book.add_record(bot.Record(bot.Name("bob"), bot.Phone("1")))
+    with book.transaction():
+        book.remove_record("bob")
+        assert "bob" not in book
+    assert "bob" not in book
@@ -0,0 +1,97 @@
+import pytest
+
+import bot_helper_with_search as bot
+
+
+def book_of(*rows):
+    book = bot.AddressBook()
+    for row in rows:
+        book.add_record(bot.Record.from_row(row))
+    return book
+
+
+def rows(book):
+    return sorted(book[name].row() for name in book)
+
+
+def test_merge_rows_takes_the_only_changed_side():
+    base = ("Ann", ("1",), "")
+    theirs = ("Ann", ("1", "2"), "")
+    assert bot.AddressBook.merge_rows(base, base, theirs) == (theirs, False)
+    assert bot.AddressBook.merge_rows(base, theirs, base) == (theirs, False)
+    assert bot.AddressBook.merge_rows(None, None, theirs) == (theirs, False)
+
+
+def test_merge_rows_merges_phones_as_sets():
+    base = ("Ann", ("1", "2"), "")
+    local = ("Ann", ("1", "2", "3"), "")
+    theirs = ("Ann", ("2", "4"), "1990-01-02")
+    assert bot.AddressBook.merge_rows(base, local, theirs) == (("Ann", ("2", "3", "4"), "1990-01-02"), False)
+
+
+def test_merge_rows_keeps_local_birthday_on_conflict():
+    base = ("Ann", ("1",), "1990-01-02")
+    local = ("Ann", ("1",), "1991-01-02")
+    theirs = ("Ann", ("1", "2"), "1992-01-02")
+    assert bot.AddressBook.merge_rows(base, local, theirs) == (("Ann", ("1", "2"), "1991-01-02"), True)
+
+
+def test_merge_rows_reports_removal_against_change():
+    base = ("Ann", ("1",), "")
+    changed = ("Ann", ("1", "2"), "")
+    assert bot.AddressBook.merge_rows(base, None, changed) == (None, True)
+    assert bot.AddressBook.merge_rows(base, changed, None) == (changed, True)
+    assert bot.AddressBook.merge_rows(base, base, None) == (None, False)
+
+
+def test_export_since_below_history_floor_is_refused(tmp_path):
+    book = book_of(("Ann", ("1",), ""))
+    book.max_history = 4
+    for number in range(10):
+        book.add_record(bot.Record.from_row(("Ann", (str(number),), "")))
+    assert book.history_floor > 1
+    with pytest.raises(Exception, match="Changes are kept from version"):
+        book.export_changes(str(tmp_path / "changes.csv"), since=1)
+    with pytest.raises(Exception, match="Changes are kept from version"):
+        book.export_changes(str(tmp_path / "changes.csv"), since=book.version + 1)
+    written, _ = book.export_changes(str(tmp_path / "changes.csv"), since=book.history_floor)
+    assert written == 1
+
+
+def test_export_and_sync_round_trip(tmp_path):
+    path = str(tmp_path / "changes.csv")
+    local = book_of(("Ann", ("1",), ""), ("Bob", ("2",), "1990-01-02"), ("Cid", ("3",), ""))
+    written, since = local.export_changes(path)
+    assert written == 3
+    remote = bot.AddressBook()
+    assert remote.import_changes(path) == (3, [])
+    assert rows(remote) == rows(local)
+
+    local.add_record(bot.Record.from_row(("Ann", ("1", "4"), "")))
+    local.remove_record("Cid")
+    local.add_record(bot.Record.from_row(("Dan", ("5",), "")))
+    remote.add_record(bot.Record.from_row(("Bob", ("2", "6"), "1990-01-02")))
+    written, since = local.export_changes(path, since)
+    assert written == 3
+    assert remote.import_changes(path) == (3, [])
+    assert rows(remote) == [
+        ("Ann", ("1", "4"), ""),
+        ("Bob", ("2", "6"), "1990-01-02"),
+        ("Dan", ("5",), ""),
+    ]
+
+    remote.export_changes(path, 0)
+    local.import_changes(path)
+    assert rows(local) == rows(remote)
+
+
+def test_sync_reports_conflicts_and_keeps_local_value(tmp_path):
+    path = str(tmp_path / "changes.csv")
+    local = book_of(("Ann", ("1",), "1990-01-02"))
+    remote = book_of(("Ann", ("1",), "1990-01-02"))
+    since = local.version
+    local.add_record(bot.Record.from_row(("Ann", ("1",), "1991-01-02")))
+    remote.add_record(bot.Record.from_row(("Ann", ("1",), "1992-01-02")))
+    local.export_changes(path, since)
+    assert remote.import_changes(path) == (0, ["Ann"])
+    assert remote["Ann"].row() == ("Ann", ("1",), "1992-01-02")